@@ -0,0 +1,209 @@
+"""Read-only JSON API for the mobile client.
+
+Rows are serialized straight from `.values()` querysets, so no model
+instances are built. Listings are paginated with keyset cursors
+(`?after=`/`?before=`) and take `?fields=` to pick the returned fields.
+Every response carries the same ETag validators as the HTML pages.
+"""
+from functools import wraps
+
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_safe
+
+from . import followgraph, stats, timeline
+from .conditional import author_etag, feed_etag, listing_etag
+from .models import Comment, Group, Post, User
+from .paginator import PER_PAGE, CursorPaginator, decode_cursor
+
+MAX_LIMIT = 100
+ORDERING = ('-pub_date', '-id')
+# Newest first, like the comment pages of the site
+COMMENT_ORDERING = ('-created', '-id')
+
+# Output field: (values() lookup, conversion)
+POST_FIELDS = {
+    'id': ('id', None),
+    'text': ('text', None),
+    'pub_date': ('pub_date', None),
+    'author': ('author__username', None),
+    'group': ('group__slug', None),
+    'comment_count': ('comment_count', None),
+    'image': ('image', lambda name: name and default_storage.url(name)),
+}
+COMMENT_FIELDS = {
+    'id': ('id', None),
+    'author': ('author__username', None),
+    'text': ('text', None),
+    'created': ('created', None),
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def api_view(view):
+    """GET-only view that reports errors as JSON."""
+
+    @require_safe
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return JsonResponse({'detail': str(error)}, status=400)
+        except PermissionDenied:
+            return JsonResponse({'detail': 'Authentication required'},
+                                status=403)
+        except Http404:
+            return JsonResponse({'detail': 'Not found'}, status=404)
+
+    return wrapper
+
+
+def authenticated(view):
+    """Rejects anonymous requests before any other decorator answers."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            raise PermissionDenied
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _requested_fields(request, available):
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(available)
+    fields = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise BadRequest(f'Unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def _serialize(rows, fields, available):
+    for row in rows:
+        item = {}
+        for name in fields:
+            lookup, convert = available[name]
+            value = row[lookup]
+            item[name] = convert(value) if convert else value
+        yield item
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', PER_PAGE))
+    except ValueError:
+        raise BadRequest('limit must be a number') from None
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _page_url(request, name, cursor):
+    query = request.GET.copy()
+    query.pop('after', None)
+    query.pop('before', None)
+    query[name] = cursor
+    return request.build_absolute_uri('?' + query.urlencode())
+
+
+def _page(request, rows):
+    """The requested page of `rows` with the URLs of its neighbours."""
+    paginator = CursorPaginator(rows, _limit(request))
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    for token in (after, before):
+        if token and decode_cursor(token, paginator.ordering,
+                                   paginator.object_list) is None:
+            raise BadRequest('Invalid cursor')
+    page = paginator.page(after=after, before=before)
+    next_url = previous_url = None
+    if page.has_next():
+        next_url = _page_url(request, 'after', page.next_cursor)
+    if page.has_previous():
+        previous_url = _page_url(request, 'before', page.previous_cursor)
+    return page, next_url, previous_url
+
+
+def _post_listing(request, queryset, ordering=ORDERING):
+    fields = _requested_fields(request, POST_FIELDS)
+    # The ordering columns are always fetched, they make the cursors
+    lookups = {POST_FIELDS[name][0] for name in fields}
+    lookups.update(field.lstrip('-') for field in ordering)
+    page, next_url, previous_url = _page(
+        request,
+        queryset.order_by(*ordering).values(*lookups))
+    return JsonResponse({
+        'results': list(_serialize(page, fields, POST_FIELDS)),
+        'next': next_url,
+        'previous': previous_url,
+    })
+
+
+@api_view
+@condition(etag_func=listing_etag)
+def posts(request):
+    return _post_listing(request, Post.objects.all())
+
+
+@api_view
+@condition(etag_func=listing_etag)
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return _post_listing(request, group.posts.all())
+
+
+@api_view
+@condition(etag_func=author_etag)
+def user_posts(request, username):
+    author = get_object_or_404(User, username=username)
+    return _post_listing(request, author.posts.all())
+
+
+@api_view
+@authenticated
+@condition(etag_func=feed_etag)
+def feed(request):
+    return _post_listing(request, timeline.feed(request.user),
+                         timeline.FEED_ORDERING)
+
+
+@api_view
+@condition(etag_func=listing_etag)
+def post_detail(request, post_id):
+    fields = _requested_fields(request, POST_FIELDS)
+    rows = Post.objects.filter(pk=post_id).values(
+        *{POST_FIELDS[name][0] for name in fields})
+    post = next(_serialize(rows[:1], fields, POST_FIELDS), None)
+    if post is None:
+        raise Http404
+    # Comments are paged like listings, `?after=` takes `comments_next`
+    comments = Comment.objects.filter(post_id=post_id).order_by(
+        *COMMENT_ORDERING).values(
+            *[lookup for lookup, _ in COMMENT_FIELDS.values()])
+    page, next_url, previous_url = _page(request, comments)
+    post['comments'] = list(_serialize(page, COMMENT_FIELDS, COMMENT_FIELDS))
+    post['comments_next'] = next_url
+    post['comments_previous'] = previous_url
+    return JsonResponse(post)
+
+
+@api_view
+@condition(etag_func=author_etag)
+def profile(request, username):
+    user = get_object_or_404(User, username=username)
+    user_stats = stats.for_user(user)
+    data = {
+        'username': user.username,
+        **{counter: getattr(user_stats, counter)
+           for counter in stats.COUNTERS},
+    }
+    if request.user.is_authenticated:
+        data['following'] = followgraph.is_following(request.user, user)
+    return JsonResponse(data)
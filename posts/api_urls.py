@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    path("posts/", api.posts, name="posts"),
+    path("posts/<int:post_id>/", api.post_detail, name="post"),
+    path("groups/<slug:slug>/posts/", api.group_posts, name="group_posts"),
+    path("users/<str:username>/", api.profile, name="profile"),
+    path("users/<str:username>/posts/", api.user_posts, name="user_posts"),
+    path("feed/", api.feed, name="feed"),
+]
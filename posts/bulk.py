@@ -0,0 +1,168 @@
+"""Helpers for writing many rows at once.
+
+`bulk_create` skips `save()` and signals, so everything the signal handlers
+maintain (timelines, counters, the search index) is stale afterwards until
+`rebuild_derived` runs.
+"""
+from itertools import islice
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import followgraph, search, stats, timeline
+from .caching import bump_generation
+from .models import Comment, Follow, Post, User
+
+BATCH_SIZE = 1000
+
+
+def create_in_chunks(model,
+                     objects,
+                     batch_size=BATCH_SIZE,
+                     ignore_conflicts=False,
+                     dates=(),
+                     prepare=None,
+                     derive=None,
+                     after_chunk=None):
+    """Inserts an iterable of unsaved `model` instances `batch_size` rows
+    per transaction, without holding them all in memory. Returns the number
+    of objects inserted.
+
+    `bulk_create` replaces the values of `auto_now_add` fields with the
+    current time. Those named in `dates` are written again afterwards, so
+    imported rows keep their dates; their objects need a primary key.
+    Rows skipped by `ignore_conflicts` would get these dates and be counted
+    too, so `prepare` should leave out rows that already exist.
+
+    `prepare(batch)` returns the objects of a chunk to insert, and
+    `derive(batch)` is called with them in the same transaction after the
+    insert. `after_chunk(created)` is called after each committed chunk
+    with the running total.
+    """
+    objects = iter(objects)
+    created = 0
+    while True:
+        batch = list(islice(objects, batch_size))
+        if not batch:
+            return created
+        with transaction.atomic():
+            if prepare is not None:
+                batch = prepare(batch)
+            values = [[getattr(obj, name) for name in dates]
+                      for obj in batch]
+            model.objects.bulk_create(batch,
+                                     ignore_conflicts=ignore_conflicts)
+            if dates:
+                for obj, saved in zip(batch, values):
+                    for name, value in zip(dates, saved):
+                        setattr(obj, name, value)
+                model.objects.bulk_update(batch, dates)
+            if derive is not None:
+                derive(batch)
+        created += len(batch)
+        if after_chunk is not None:
+            after_chunk(created)
+
+
+def reset_sequence(model):
+    # Rows inserted with explicit ids leave PostgreSQL's sequence behind
+    statements = connection.ops.sequence_reset_sql(no_style(), [model])
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def chunked(values):
+    """`values` in lists short enough to pass as the parameters of one
+    query."""
+    size = min(BATCH_SIZE, connection.features.max_query_params
+               or BATCH_SIZE)
+    values = iter(values)
+    while True:
+        chunk = list(islice(values, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def existing_ids(model, ids):
+    found = set()
+    for chunk in chunked(ids):
+        found.update(
+            model.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+    return found
+
+
+def existing_follows(pairs):
+    """The `(user_id, author_id)` pairs of `pairs` already followed."""
+    pairs = set(pairs)
+    found = set()
+    for chunk in chunked({user_id for user_id, _ in pairs}):
+        found.update(
+            Follow.objects.filter(user_id__in=chunk).values_list(
+                'user_id', 'author_id'))
+    return found & pairs
+
+
+def followers_of(author_ids):
+    followers = set()
+    for chunk in chunked(author_ids):
+        followers.update(
+            Follow.objects.filter(author_id__in=chunk).values_list(
+                'user_id', flat=True))
+    return followers
+
+
+def reindex(posts=(), comments=()):
+    """Indexes posts and comments written in bulk."""
+    for chunk in chunked(post.pk for post in posts):
+        search.reindex(post_ids=chunk)
+    for chunk in chunked(comment.pk for comment in comments):
+        search.reindex(comment_ids=chunk)
+
+
+def rebuild_comment_counts(post_ids=None):
+    counts = Comment.objects.filter(post=OuterRef('pk')).order_by().values(
+        'post').annotate(total=Count('id')).values('total')
+    # Bumped like a comment posted through the site, so cached cards of
+    # the posts are replaced
+    change = {
+        'comment_count': Coalesce(Subquery(counts), 0),
+        'version': F('version') + 1
+    }
+    if post_ids is None:
+        Post.objects.update(**change)
+        return
+    for chunk in chunked(post_ids):
+        Post.objects.filter(pk__in=chunk).update(**change)
+
+
+def rebuild_users(user_ids, timelines=(), log=None):
+    """Recomputes the counters of `user_ids` and the timelines of
+    `timelines`, after their rows were written in bulk."""
+    log = log or (lambda message: None)
+    for user_id in user_ids:
+        stats.rebuild(user_id)
+    log(f'{len(user_ids)} user counters rebuilt')
+    followgraph.forget(user_ids)
+    for user_id in timelines:
+        timeline.rebuild(user_id)
+    log(f'{len(timelines)} timelines rebuilt')
+    bump_generation()
+
+
+def rebuild_derived(log=None):
+    """Recomputes everything the signal handlers would have maintained."""
+    log = log or (lambda message: None)
+    rebuild_comment_counts()
+    log('comment counters rebuilt')
+    log(f'{stats.rebuild_all()} user counters rebuilt')
+    user_ids = list(User.objects.values_list('id', flat=True))
+    followgraph.forget(user_ids)
+    for user_id in user_ids:
+        timeline.rebuild(user_id)
+    log(f'{len(user_ids)} timelines rebuilt')
+    log(f'{search.rebuild()} search postings written')
+    bump_generation()
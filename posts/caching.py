@@ -0,0 +1,94 @@
+import time
+
+from django.core.cache import cache
+
+from .models import User
+
+GENERATION_KEY = 'posts:generation'
+CHANGED_KEY = 'posts:changed'
+USER_VERSION_KEY = 'posts:user_version:{}'
+USER_ID_KEY = 'posts:user_id:{}'
+
+
+def _initial_value():
+    # Milliseconds since the epoch, so a counter lost to eviction or a
+    # restart never comes back with a value that was already handed out.
+    return int(time.time() * 1000)
+
+
+def get_counter(key):
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _initial_value(), None)
+        value = cache.get(key)
+    return value
+
+
+def bump_counter(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_value(), None)
+        return cache.get(key)
+
+
+def get_generation():
+    """Current change generation of post listings.
+
+    Listing fragments are cached under keys that include it, so bumping the
+    counter makes every stale fragment unreachable at once.
+    """
+    return get_counter(GENERATION_KEY)
+
+
+def bump_generation():
+    generation = bump_counter(GENERATION_KEY)
+    mark_changed()
+    return generation
+
+
+def get_user_version(user_id):
+    """Counter of changes to what a user's profile card shows besides
+    posts: follower and following counts and follow buttons."""
+    return get_counter(USER_VERSION_KEY.format(user_id))
+
+
+def bump_user_version(user_id):
+    return bump_counter(USER_VERSION_KEY.format(user_id))
+
+
+def get_user_id(username):
+    """Id of the user named `username`, or None; cached, and kept up to
+    date by `posts.signals` when users are saved or deleted."""
+    user_id = cache.get(USER_ID_KEY.format(username))
+    if user_id is None:
+        user_id = User.objects.filter(username=username).values_list(
+            'id', flat=True).first()
+        if user_id is not None:
+            remember_user_id(username, user_id)
+    return user_id
+
+
+def remember_user_id(username, user_id):
+    cache.set(USER_ID_KEY.format(username), user_id, None)
+
+
+def forget_user_id(username):
+    cache.delete(USER_ID_KEY.format(username))
+
+
+def mark_changed():
+    cache.set(CHANGED_KEY, time.time(), None)
+
+
+def get_changed_at():
+    """Unix time of the last change to anything shown on public pages.
+
+    A lost value restarts at the current time, which can only make clients
+    download a page again, never keep a stale one.
+    """
+    changed = cache.get(CHANGED_KEY)
+    if changed is None:
+        cache.add(CHANGED_KEY, time.time(), None)
+        changed = cache.get(CHANGED_KEY, time.time())
+    return changed
@@ -0,0 +1,58 @@
+"""Validators for conditional GET of post pages.
+
+Everything a page shows is covered by counters kept in the cache, so a
+`304 Not Modified` costs no database queries:
+- the listing generation, bumped on every change to posts, comments,
+  groups and thumbnails (`posts.caching`);
+- the user version of the author in the URL, bumped when they gain or
+  lose a follower or follow somebody, found by their id cached per
+  username;
+- the viewer, since pages render their name, forms and follow buttons.
+
+Last-Modified is only sent to anonymous visitors: a client that only
+revalidates by date would otherwise keep a page rendered for somebody
+else after logging in or out. Neither is sent for a page read from a
+replica that may lag behind the counters, see `yatube.routers`.
+"""
+import hashlib
+from datetime import datetime, timezone
+
+from yatube.routers import may_cache
+
+from .caching import (get_changed_at, get_generation, get_user_id,
+                      get_user_version)
+
+
+def _etag(request, *parts):
+    if not may_cache():
+        return None
+    viewer = request.user.pk if request.user.is_authenticated else 0
+    state = [
+        request.path,
+        sorted(request.GET.lists()),
+        viewer,
+        get_generation(),
+        *parts,
+    ]
+    return hashlib.md5(repr(state).encode()).hexdigest()
+
+
+def listing_etag(request, *args, **kwargs):
+    return _etag(request)
+
+
+def author_etag(request, username, *args, **kwargs):
+    """For pages with the profile card of `username`."""
+    user_id = get_user_id(username)
+    return _etag(request, user_id and get_user_version(user_id))
+
+
+def feed_etag(request, *args, **kwargs):
+    """For the viewer's follow feed, which changes when they follow."""
+    return _etag(request, get_user_version(request.user.pk))
+
+
+def last_modified(request, *args, **kwargs):
+    if request.user.is_authenticated or not may_cache():
+        return None
+    return datetime.fromtimestamp(get_changed_at(), timezone.utc)
@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from .caching import get_generation
+
+
+def listing_cache(request):
+    return {
+        'listing_generation': SimpleLazyObject(get_generation),
+        'listing_cache_timeout': settings.LISTING_CACHE_TIMEOUT,
+    }
@@ -1,4 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+
+from . import uploads
 from .models import Comment, Post
 
 
@@ -7,6 +10,20 @@ class PostForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields['group'].required = False
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            image = uploads.normalize(image)
+            self.instance.image_width = image.width
+            self.instance.image_height = image.height
+        elif not image:
+            self.instance.image_width = self.instance.image_height = None
+        else:
+            return image
+        # Made again by the thumbnail job of the new image
+        self.instance.image_variants = self.instance.image_preview = ''
+        return image
+
     class Meta:
         model = Post
         fields = ('group', 'text', 'image')
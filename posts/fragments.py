@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .thumbnails import Placeholder, resolve_thumbnails
+
+POST_ITEM_TEMPLATE = 'post_item.html'
+
+
+def fragment_key(post, can_edit):
+    """The only viewer-dependent part of a post card is the edit link, so
+    each post version has at most two variants: for its author and for
+    everybody else."""
+    return f'post_item:{post.pk}:{post.version}:{int(can_edit)}'
+
+
+def render_post_items(posts, user):
+    """Renders post cards, fetching all cached ones with a single
+    `get_many` and writing the rendered misses back with `set_many`.
+    Returns the HTML and whether it may be cached.
+
+    Cards still showing a thumbnail placeholder are not cached: rendering
+    them again is what picks up the generated thumbnail, or resubmits a
+    job that was lost or failed.
+    """
+    posts = list(posts)
+    keys = [fragment_key(post, post.author_id == user.pk) for post in posts]
+    cached = cache.get_many(keys)
+    to_render = [(post, key) for post, key in zip(posts, keys)
+                 if key not in cached]
+    thumbnails = resolve_thumbnails(post for post, _ in to_render)
+    missing = {}
+    complete = True
+    for post, key in to_render:
+        thumbnail = thumbnails.get(post.pk)
+        rendered = render_to_string(POST_ITEM_TEMPLATE, {
+            'post': post,
+            'user': user,
+            'thumbnail': thumbnail,
+        })
+        if isinstance(thumbnail, Placeholder):
+            cached[key] = rendered
+            complete = False
+        else:
+            missing[key] = rendered
+    if missing:
+        cache.set_many(missing, settings.POST_FRAGMENT_TIMEOUT)
+        cached.update(missing)
+    return mark_safe(''.join(cached[key] for key in keys)), complete
@@ -0,0 +1,42 @@
+"""Sample arguments that resolve every route to existing rows, shared by
+the commands that exercise all views."""
+from django.core.management.base import CommandError
+from django.urls import URLPattern
+
+from posts.models import Follow, Post
+
+DUMMY_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+    }
+}
+
+
+def sample_arguments():
+    """Returns `(viewer, kwargs, query)`: a user who follows somebody, URL
+    keyword arguments by converter name and GET parameters."""
+    post = (Post.objects.filter(group__isnull=False).first()
+            or Post.objects.first())
+    if post is None:
+        raise CommandError('Needs at least one post to build URLs')
+    follow = Follow.objects.select_related('user').first()
+    viewer = follow.user if follow else post.author
+    kwargs = {
+        'username': post.author.username,
+        'post_id': post.pk,
+        'slug': post.group.slug if post.group else '',
+    }
+    words = post.text.split()
+    query = {'q': words[0]} if words else {}
+    return viewer, kwargs, query
+
+
+def patterns(*urlconfs):
+    for urlconf in urlconfs:
+        for pattern in urlconf.urlpatterns:
+            if isinstance(pattern, URLPattern):
+                yield pattern
+
+
+def route_kwargs(pattern, kwargs):
+    return {name: kwargs[name] for name in pattern.pattern.converters}
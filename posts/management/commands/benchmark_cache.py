@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'sqlite': 'yatube.sqlite_cache.SQLiteCache',
+}
+COUNTER_KEY = 'benchmark:counter'
+
+
+def run_worker(backend, location, operations, keys, seed):
+    """Read-through workload with a skewed key distribution.
+
+    Every 100th operation bumps a shared counter, like a listing generation
+    bump; the final counter value shows whether workers see each other's
+    writes.
+    """
+    cache = import_string(BACKENDS[backend])(location, {
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': keys * 2
+        }
+    })
+    rng = random.Random(seed)
+    payload = 'x' * 2048
+    hits = 0
+    started = time.perf_counter()
+    for operation in range(operations):
+        key = f'post_item:{int(rng.paretovariate(1.2)) % keys}'
+        if cache.get(key) is None:
+            cache.set(key, payload)
+        else:
+            hits += 1
+        if operation % 100 == 0:
+            try:
+                cache.incr(COUNTER_KEY)
+            except ValueError:
+                cache.add(COUNTER_KEY, 1)
+    return hits, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = ('Compares the shared SQLite cache with LocMemCache under '
+            'several worker processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--operations', type=int, default=5000)
+        parser.add_argument('--keys', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        operations = options['operations']
+        context = multiprocessing.get_context('fork')
+        for backend in BACKENDS:
+            with tempfile.TemporaryDirectory() as directory:
+                location = os.path.join(directory, 'cache.sqlite3')
+                jobs = [(backend, location, operations, options['keys'], seed)
+                        for seed in range(processes)]
+                started = time.perf_counter()
+                with context.Pool(processes) as pool:
+                    results = pool.starmap(run_worker, jobs)
+                elapsed = time.perf_counter() - started
+
+                counter = import_string(BACKENDS[backend])(location, {}).get(
+                    COUNTER_KEY)
+            total = processes * operations
+            hits = sum(hits for hits, _ in results)
+            self.stdout.write(
+                f'{backend:>7}: {total / elapsed:10.0f} ops/s, '
+                f'hit rate {hits / total:6.1%}, '
+                f'shared counter {counter} of '
+                f'{processes * len(range(0, operations, 100))}')
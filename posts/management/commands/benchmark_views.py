@@ -0,0 +1,136 @@
+import json
+import math
+import time
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import urls as posts_urls
+from users import urls as users_urls
+
+from ._routes import DUMMY_CACHES, patterns, route_kwargs, sample_arguments
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def _content_length(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+class Command(BaseCommand):
+    help = ('Requests every route of posts/urls.py and users/urls.py and '
+            'reports latency percentiles, query counts and response sizes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests',
+                            type=int,
+                            default=50,
+                            help='Timed requests per route.')
+        parser.add_argument('--warmup',
+                            type=int,
+                            default=2,
+                            help='Untimed requests per route before timing.')
+        parser.add_argument('--no-cache',
+                            action='store_true',
+                            help='Disable caches, measure full renders.')
+        parser.add_argument('--save', help='Write results to this JSON file.')
+        parser.add_argument('--compare',
+                            help='Compare with results saved by --save.')
+        parser.add_argument('--threshold',
+                            type=float,
+                            default=0.2,
+                            help='Relative p95 slowdown that counts as a '
+                            'regression with --compare.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('Needs at least one request per route')
+        viewer, kwargs, query = sample_arguments()
+        client = Client()
+        client.force_login(viewer)
+
+        results = {}
+        with ExitStack() as stack:
+            if options['no_cache']:
+                stack.enter_context(override_settings(CACHES=DUMMY_CACHES))
+            for pattern in patterns(posts_urls, users_urls):
+                url = reverse(pattern.name,
+                              kwargs=route_kwargs(pattern, kwargs))
+                for _ in range(options['warmup']):
+                    self.request(client, url, query)
+                samples = [
+                    self.request(client, url, query)
+                    for _ in range(options['requests'])
+                ]
+                results[pattern.name] = self.summarize(samples)
+
+        self.report(results)
+        if options['save']:
+            with open(options['save'], 'w') as baseline:
+                json.dump({'routes': results}, baseline, indent=2)
+            self.stdout.write(f'Saved to {options["save"]}')
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                baseline = json.load(baseline)['routes']
+            self.compare(baseline, results, options['threshold'])
+
+    def request(self, client, url, query):
+        """`(seconds, queries, bytes)` of one GET; writes are rolled back
+        so routes like follow/unfollow can be requested repeatedly."""
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url, query)
+                size = _content_length(response)
+                elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return elapsed, len(queries), size
+
+    def summarize(self, samples):
+        timings = [elapsed * 1000 for elapsed, _, _ in samples]
+        summary = {
+            f'p{percent}': round(percentile(timings, percent), 3)
+            for percent in PERCENTILES
+        }
+        summary['queries'] = max(queries for _, queries, _ in samples)
+        summary['bytes'] = max(size for _, _, size in samples)
+        return summary
+
+    def report(self, results):
+        self.stdout.write(f'{"route":<18}{"p50 ms":>9}{"p95 ms":>9}'
+                          f'{"p99 ms":>9}{"queries":>9}{"bytes":>9}')
+        for name, result in results.items():
+            self.stdout.write(f'{name:<18}{result["p50"]:>9.2f}'
+                              f'{result["p95"]:>9.2f}{result["p99"]:>9.2f}'
+                              f'{result["queries"]:>9}{result["bytes"]:>9}')
+
+    def compare(self, baseline, results, threshold):
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write(f'{name}: not in the baseline')
+                continue
+            change = result['p95'] / before['p95'] - 1 if before['p95'] else 0
+            queries = result['queries'] - before['queries']
+            self.stdout.write(f'{name:<18} p95 {change:+7.1%}, '
+                              f'queries {queries:+d}, '
+                              f'bytes {result["bytes"] - before["bytes"]:+d}')
+            if change > threshold or queries > 0:
+                regressions.append(name)
+        if regressions:
+            raise CommandError('Slower than the baseline: ' +
+                               ', '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,96 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+
+from posts import urls
+
+from ._routes import (DUMMY_CACHES, patterns, route_kwargs,
+                      sample_arguments)
+
+# Plans that need a sort or scan by design, reported but not failed on
+EXPECTED = {
+    'new_post': 'the group field lists every group',
+    'search': 'results are ranked by score, which no index can provide',
+}
+
+
+def _sqlite_problems(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        details = [row[-1] for row in cursor.fetchall()]
+    for detail in details:
+        # "SCAN posts_post" reads the whole table; "SCAN ... USING INDEX"
+        # walks an index in order and stops at the LIMIT
+        if re.match(r'SCAN (TABLE )?\w+( AS \w+)?$', detail):
+            yield detail
+        elif 'USE TEMP B-TREE' in detail:
+            yield detail
+
+
+def _postgresql_problems(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ' + sql, params)
+        lines = [row[0] for row in cursor.fetchall()]
+    for line in lines:
+        node = line.strip().lstrip('->').strip()
+        if node.startswith(('Seq Scan', 'Sort ')):
+            yield node
+
+
+EXPLAINERS = {
+    'sqlite': _sqlite_problems,
+    'postgresql': _postgresql_problems,
+}
+
+
+class Command(BaseCommand):
+    help = ('Runs EXPLAIN on the queries behind every page of posts/urls.py '
+            'and flags full table scans and temporary sorts.')
+
+    def handle(self, *args, **options):
+        explain = EXPLAINERS.get(connection.vendor)
+        if explain is None:
+            raise CommandError(f'EXPLAIN of {connection.vendor} is not '
+                               'supported')
+        viewer, kwargs, query = sample_arguments()
+
+        failed = 0
+        for pattern in patterns(urls):
+            queries = self._capture(pattern, kwargs, viewer, query)
+            problems = [(sql, problem) for sql, params in queries
+                        for problem in explain(sql, params)]
+            if not problems:
+                self.stdout.write(f'{pattern.name}: {len(queries)} queries, '
+                                  'all indexed')
+                continue
+            if pattern.name in EXPECTED:
+                self.stdout.write(f'{pattern.name}: expected, '
+                                  f'{EXPECTED[pattern.name]}')
+            else:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{pattern.name}:'))
+            for sql, problem in problems:
+                self.stdout.write(f'    {problem}\n        {sql}')
+        if failed:
+            raise CommandError(f'{failed} views read without an index')
+        self.stdout.write(self.style.SUCCESS('No unexpected scans or sorts'))
+
+    def _capture(self, pattern, kwargs, viewer, query):
+        """SELECTs a GET of `pattern` runs, with caches disabled and every
+        write rolled back."""
+        request = RequestFactory().get('/', query)
+        request.user = viewer
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith('SELECT'):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with override_settings(CACHES=DUMMY_CACHES), transaction.atomic():
+            with connection.execute_wrapper(record):
+                pattern.callback(request, **route_kwargs(pattern, kwargs))
+            transaction.set_rollback(True)
+        return queries
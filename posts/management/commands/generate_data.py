@@ -0,0 +1,159 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from posts import bulk
+from posts.models import Comment, Follow, Group, Post, User
+
+# Shape of Pareto distributions with an 80/20 split: a fifth of the users
+# write most of the posts and get most of the followers
+PARETO_ALPHA = 1.16
+GROUPED_SHARE = 0.7
+WORDS = ('кот собака утро вечер город река лес дом дорога книга музыка '
+         'работа отпуск море погода кофе чай друг семья проект код '
+         'сервер база запрос ответ страница поиск кэш очередь поток '
+         'новый старый быстрый медленный большой маленький первый '
+         'последний сегодня вчера завтра снова').split()
+
+
+def _text(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high))).capitalize()
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with a synthetic dataset: users with '
+            'power-law activity, groups, posts, follows and comments.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--follows',
+                            type=int,
+                            default=20,
+                            help='Average number of authors a user follows.')
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--days',
+                            type=int,
+                            default=365,
+                            help='Posts are spread over this many days.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix',
+                            default='synth',
+                            help='Prefix of generated usernames and slugs.')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users named {prefix}* already exist, '
+                               'pick another --prefix')
+        if options['users'] < 2:
+            raise CommandError('Needs at least two users')
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now()
+
+        user_ids = self.create_users(prefix, options['users'])
+        group_ids = self.create_groups(prefix, options['groups'])
+        # Activity of each user, reused for who writes, comments and
+        # gets followed
+        weights = [self.rng.paretovariate(PARETO_ALPHA) for _ in user_ids]
+        posts = self.create_posts(user_ids, weights, group_ids,
+                                  options['posts'], options['days'])
+        self.create_follows(user_ids, weights, options['follows'])
+        self.create_comments(user_ids, weights, posts, options['comments'])
+
+        bulk.rebuild_derived(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def create_users(self, prefix, count):
+        password = make_password('password')
+        users = (User(username=f'{prefix}{number}', password=password)
+                 for number in range(count))
+        bulk.create_in_chunks(User, users)
+        self.stdout.write(f'{count} users')
+        return list(
+            User.objects.filter(username__startswith=prefix).values_list(
+                'id', flat=True))
+
+    def create_groups(self, prefix, count):
+        groups = (Group(title=f'Группа {number}',
+                        slug=f'{prefix}-{number}',
+                        description=_text(self.rng, 5, 20))
+                  for number in range(count))
+        bulk.create_in_chunks(Group, groups)
+        self.stdout.write(f'{count} groups')
+        return list(
+            Group.objects.filter(slug__startswith=f'{prefix}-').values_list(
+                'id', flat=True))
+
+    def create_posts(self, user_ids, weights, group_ids, count, days):
+        """Returns `(id, pub_date)` of the new posts."""
+        rng = self.rng
+        last_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+        authors = rng.choices(user_ids, weights, k=count)
+        group_weights = [rng.paretovariate(PARETO_ALPHA) for _ in group_ids]
+
+        def posts():
+            for number, author_id in enumerate(authors, last_id + 1):
+                grouped = group_ids and rng.random() < GROUPED_SHARE
+                yield Post(id=number,
+                           text=_text(rng, 5, 60),
+                           author_id=author_id,
+                           group_id=rng.choices(group_ids, group_weights)[0]
+                           if grouped else None,
+                           pub_date=self.now -
+                           timedelta(seconds=rng.uniform(0, days * 86400)))
+
+        # With ids, so the dates can be written after the insert
+        bulk.create_in_chunks(Post, posts(), dates=('pub_date', ))
+        bulk.reset_sequence(Post)
+        self.stdout.write(f'{count} posts')
+        return list(
+            Post.objects.filter(id__gt=last_id).order_by().values_list(
+                'id', 'pub_date'))
+
+    def create_follows(self, user_ids, weights, average):
+        if not average:
+            return
+        rng = self.rng
+
+        def follows():
+            for user_id in user_ids:
+                count = min(int(rng.expovariate(1 / average)),
+                            len(user_ids) - 1)
+                # Popular authors collect most of the followers
+                for author_id in set(rng.choices(user_ids, weights,
+                                                 k=count)):
+                    if author_id != user_id:
+                        yield Follow(user_id=user_id, author_id=author_id)
+
+        created = bulk.create_in_chunks(Follow,
+                                        follows(),
+                                        ignore_conflicts=True)
+        self.stdout.write(f'{created} follows')
+
+    def create_comments(self, user_ids, weights, posts, count):
+        if not posts:
+            return
+        rng = self.rng
+        last_id = Comment.objects.aggregate(last=Max('id'))['last'] or 0
+
+        def comments():
+            authors = rng.choices(user_ids, weights, k=count)
+            for number, author_id in enumerate(authors, last_id + 1):
+                post_id, pub_date = rng.choice(posts)
+                age = (self.now - pub_date).total_seconds()
+                yield Comment(id=number,
+                              post_id=post_id,
+                              author_id=author_id,
+                              text=_text(rng, 2, 30),
+                              created=pub_date +
+                              timedelta(seconds=rng.uniform(0, age)))
+
+        bulk.create_in_chunks(Comment, comments(), dates=('created', ))
+        bulk.reset_sequence(Comment)
+        self.stdout.write(f'{count} comments')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Generates the srcset variants and inline previews of post '
+            'images that have none, e.g. ones uploaded before variants '
+            'existed.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image=None).filter(
+            image_variants='').values_list('pk', 'image')
+        generated = failed = 0
+        for post_id, image_name in posts.iterator():
+            if thumbnails.generate(post_id, image_name):
+                generated += 1
+            else:
+                failed += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Processed {generated} post images, '
+                               f'{failed} failed'))
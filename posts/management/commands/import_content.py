@@ -0,0 +1,340 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import bulk
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class RejectedRow(ValueError):
+    pass
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                yield RejectedRow(f'invalid JSON: {error}')
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        # Empty CSV cells mean "not given", like a missing JSON key
+        yield {key: value for key, value in row.items() if value != ''}
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+def _lookup(mapping, value, what):
+    try:
+        return mapping[value]
+    except KeyError:
+        raise RejectedRow(f'unknown {what} {value!r}') from None
+
+
+def _required(row, name):
+    try:
+        return row[name]
+    except KeyError:
+        raise RejectedRow(f'missing {name!r}') from None
+
+
+def _integer(row, name, required=True):
+    value = row.get(name)
+    if value is None:
+        if required:
+            raise RejectedRow(f'missing {name!r}')
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RejectedRow(f'invalid {name} {value!r}') from None
+
+
+def _date(value):
+    if value is None:
+        return timezone.now()
+    date = parse_datetime(value)
+    if date is None:
+        raise RejectedRow(f'invalid date {value!r}')
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+class Importer:
+    """Turns input rows of one kind into unsaved model instances, resolving
+    usernames and group slugs through maps loaded once up front.
+
+    Posts and comments are keyed by their `id`, so a chunk inserted again
+    after a crash is skipped instead of duplicated.
+    """
+    date_fields = ()
+
+    def __init__(self):
+        self.users = dict(User.objects.values_list('username', 'id'))
+
+    def user(self, row, name):
+        return _lookup(self.users, _required(row, name), 'user')
+
+    def check(self, batch):
+        """Returns the objects of `batch` to insert and the reasons the
+        others were rejected.
+
+        Rows whose id is taken are rejected rather than left to
+        `ignore_conflicts`, which would still write their dates over the
+        existing rows and count them as inserted.
+        """
+        name = self.model._meta.model_name
+        taken = bulk.existing_ids(self.model, {obj.pk for obj in batch})
+        accepted = []
+        errors = []
+        for obj in batch:
+            if obj.pk in taken:
+                errors.append(f'{name} {obj.pk}: id already exists')
+            else:
+                taken.add(obj.pk)
+                accepted.append(obj)
+        return accepted, errors
+
+    def derive(self, batch):
+        """Updates what depends on the inserted `batch` alone; returns the
+        ids of the users whose counters and timelines are now stale."""
+        return set()
+
+    def rebuild(self, user_ids, log):
+        bulk.rebuild_users(user_ids, log=log)
+
+
+class PostImporter(Importer):
+    model = Post
+    date_fields = ('pub_date', )
+
+    def __init__(self):
+        super().__init__()
+        self.groups = dict(Group.objects.values_list('slug', 'id'))
+
+    def build(self, row):
+        group = row.get('group')
+        return Post(id=_integer(row, 'id'),
+                    text=_required(row, 'text'),
+                    author_id=self.user(row, 'author'),
+                    group_id=group and _lookup(self.groups, group, 'group'),
+                    pub_date=_date(row.get('pub_date')))
+
+    def derive(self, batch):
+        bulk.reindex(posts=batch)
+        return {post.author_id for post in batch}
+
+    def rebuild(self, user_ids, log):
+        bulk.rebuild_users(user_ids,
+                           timelines=bulk.followers_of(user_ids),
+                           log=log)
+
+
+class CommentImporter(Importer):
+    model = Comment
+    date_fields = ('created', )
+
+    def build(self, row):
+        return Comment(id=_integer(row, 'id'),
+                       post_id=_integer(row, 'post'),
+                       text=_required(row, 'text'),
+                       author_id=self.user(row, 'author'),
+                       created=_date(row.get('created')))
+
+    def check(self, batch):
+        batch, errors = super().check(batch)
+        # A dangling post would fail the whole chunk at commit
+        post_ids = bulk.existing_ids(Post,
+                                     {comment.post_id
+                                      for comment in batch})
+        return ([comment for comment in batch if comment.post_id in post_ids],
+                errors + [
+                    f'comment {comment.id}: unknown post {comment.post_id}'
+                    for comment in batch if comment.post_id not in post_ids
+                ])
+
+    def derive(self, batch):
+        bulk.rebuild_comment_counts({comment.post_id for comment in batch})
+        bulk.reindex(comments=batch)
+        return set()
+
+
+class FollowImporter(Importer):
+    model = Follow
+
+    def build(self, row):
+        user_id = self.user(row, 'user')
+        author_id = self.user(row, 'author')
+        if user_id == author_id:
+            raise RejectedRow(f'{row["user"]!r} cannot follow themselves')
+        return Follow(user_id=user_id, author_id=author_id)
+
+    def check(self, batch):
+        taken = bulk.existing_follows(
+            (follow.user_id, follow.author_id) for follow in batch)
+        accepted = []
+        errors = []
+        for follow in batch:
+            pair = (follow.user_id, follow.author_id)
+            if pair in taken:
+                errors.append(f'follow {follow.user_id} -> '
+                              f'{follow.author_id}: already exists')
+            else:
+                taken.add(pair)
+                accepted.append(follow)
+        return accepted, errors
+
+    def derive(self, batch):
+        return {follow.user_id
+                for follow in batch} | {follow.author_id
+                                        for follow in batch}
+
+    def rebuild(self, user_ids, log):
+        # Only the followers' timelines changed, but the saved ids do not
+        # tell them from the authors
+        bulk.rebuild_users(user_ids, timelines=user_ids, log=log)
+
+
+IMPORTERS = {
+    'posts': PostImporter,
+    'comments': CommentImporter,
+    'follows': FollowImporter,
+}
+
+
+class Command(BaseCommand):
+    help = ('Streams posts, comments or follows from a JSONL or CSV file '
+            'into the database with batched inserts. Rows are keyed by '
+            'username and group slug, posts and comments by id; an '
+            'interrupted import resumes from its checkpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=IMPORTERS)
+        parser.add_argument('path')
+        parser.add_argument('--format',
+                            choices=READERS,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=bulk.BATCH_SIZE)
+        parser.add_argument('--restart',
+                            action='store_true',
+                            help='Ignore an existing checkpoint.')
+        parser.add_argument('--no-rebuild',
+                            action='store_true',
+                            help='Skip rebuilding the counters and '
+                            'timelines of the users the import touched.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        extension = os.path.splitext(path)[1].lstrip('.')
+        reader = READERS.get(options['format'] or extension)
+        if reader is None:
+            raise CommandError('Pass --format, cannot tell it from '
+                               f'{path!r}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        self.checkpoint_path = path + '.checkpoint'
+        if options['restart'] and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        done, user_ids = self.read_checkpoint()
+        if done:
+            self.stdout.write(f'Resuming after row {done}')
+
+        importer = IMPORTERS[options['kind']]()
+        self.position = done
+        self.user_ids = user_ids
+        self.rejected = 0
+        started = time.perf_counter()
+
+        def prepare(batch):
+            batch, errors = importer.check(batch)
+            for error in errors:
+                self.reject(error)
+            return batch
+
+        def derive(batch):
+            self.user_ids.update(importer.derive(batch))
+
+        def after_chunk(created):
+            self.write_checkpoint()
+            if options['verbosity'] > 1:
+                self.stdout.write(f'row {self.position}: '
+                                  f'{self.rate(created, started)}')
+
+        with open(path, newline='', encoding='utf-8') as stream:
+            rows = islice(reader(stream), done, None)
+            objects = self.build_all(importer, rows)
+            # A crash between a commit and its checkpoint re-inserts the
+            # chunk; its rows are then rejected by their keys.
+            # `ignore_conflicts` only covers rows written meanwhile
+            created = bulk.create_in_chunks(importer.model,
+                                            objects,
+                                            batch_size=options['batch_size'],
+                                            ignore_conflicts=True,
+                                            dates=importer.date_fields,
+                                            prepare=prepare,
+                                            derive=derive,
+                                            after_chunk=after_chunk)
+
+        bulk.reset_sequence(importer.model)
+        self.stdout.write(f'Imported {created} {options["kind"]}, '
+                          f'rejected {self.rejected}: '
+                          f'{self.rate(created, started)}')
+        if not options['no_rebuild']:
+            importer.rebuild(self.user_ids, log=self.stdout.write)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def build_all(self, importer, rows):
+        for row in rows:
+            self.position += 1
+            try:
+                if isinstance(row, RejectedRow):
+                    raise row
+                if not isinstance(row, dict):
+                    raise RejectedRow('not an object')
+                yield importer.build(row)
+            except RejectedRow as error:
+                self.reject(f'row {self.position}: {error}')
+
+    def reject(self, reason):
+        self.rejected += 1
+        self.stderr.write(reason)
+
+    def rate(self, created, started):
+        elapsed = time.perf_counter() - started
+        return f'{created / elapsed if elapsed else 0:.0f} rows/s'
+
+    def read_checkpoint(self):
+        """The number of rows done and the ids of the users they
+        touched."""
+        try:
+            with open(self.checkpoint_path) as checkpoint:
+                saved = json.load(checkpoint)
+        except FileNotFoundError:
+            return 0, set()
+        return saved['position'], set(saved['users'])
+
+    def write_checkpoint(self):
+        # Replaced atomically, so a crash never leaves a torn checkpoint
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump(
+                {
+                    'position': self.position,
+                    'users': sorted(self.user_ids)
+                }, checkpoint)
+        os.replace(temporary, self.checkpoint_path)
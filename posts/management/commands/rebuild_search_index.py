@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of posts and comments.'
+
+    def handle(self, *args, **options):
+        written = search.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {written} search postings'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds materialized follow feeds from the Follow table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames',
+                            nargs='*',
+                            help='Only rebuild feeds of these users.')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        rebuilt = 0
+        for user_id in list(users.values_list('id', flat=True)):
+            timeline.rebuild(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} timelines'))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import stats
+from posts.models import UserStats
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds denormalized post/follower counters, or only reports '
+            'drift with --verify.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify',
+                            action='store_true',
+                            help='Report mismatching counters, change nothing.')
+
+    def handle(self, *args, **options):
+        stored = {
+            row['user_id']: row
+            for row in UserStats.objects.values('user_id', *stats.COUNTERS)
+        }
+        mismatched = []
+        for user_id, expected in stats.expected_counts():
+            actual = stored.get(user_id)
+            # Users nothing happened to have no row, see `stats.for_user`
+            counts = actual or dict.fromkeys(stats.COUNTERS, 0)
+            if any(counts[counter] != expected[counter]
+                   for counter in stats.COUNTERS):
+                mismatched.append((user_id, actual, expected))
+
+        for user_id, actual, expected in mismatched:
+            stored_counts = actual and {
+                counter: actual[counter]
+                for counter in stats.COUNTERS
+            }
+            self.stdout.write(f'user {user_id}: stored {stored_counts}, '
+                              f'expected {expected}')
+        if options['verify']:
+            if mismatched:
+                raise CommandError(f'{len(mismatched)} users out of sync')
+            self.stdout.write(self.style.SUCCESS('All counters in sync'))
+            return
+
+        for user_id, _, expected in mismatched:
+            UserStats.objects.update_or_create(user_id=user_id,
+                                               defaults=expected)
+        self.stdout.write(
+            self.style.SUCCESS(f'Fixed {len(mismatched)} users'))
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.27 on 2026-10-18 08:06
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Post = apps.get_model('posts', 'Post')
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+
+    def grouped(queryset, field):
+        rows = queryset.order_by().values(field).annotate(total=Count('id'))
+        return {row[field]: row['total'] for row in rows}
+
+    posts = grouped(Post.objects, 'author')
+    followers = grouped(Follow.objects, 'author')
+    follows = grouped(Follow.objects, 'user')
+    UserStats.objects.bulk_create([
+        UserStats(user_id=user_id,
+                  post_count=posts.get(user_id, 0),
+                  follower_count=followers.get(user_id, 0),
+                  follows_count=follows.get(user_id, 0))
+        for user_id in User.objects.values_list('id', flat=True)
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0008_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('follower_count', models.PositiveIntegerField(default=0)),
+                ('follows_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
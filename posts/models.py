@@ -13,6 +13,17 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    FEED_FIELDS = ('text', 'pub_date', 'image', 'image_variants',
+                   'image_preview', 'comment_count', 'version', 'author',
+                   'author__username', 'group', 'group__slug', 'group__title')
+
+    def for_feed(self):
+        """Posts joined with what `post_item.html` renders, and nothing
+        else."""
+        return self.select_related('author', 'group').only(*self.FEED_FIELDS)
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField("date published", auto_now_add=True)
@@ -25,13 +36,43 @@ class Post(models.Model):
                               on_delete=models.SET_NULL,
                               related_name="posts")
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # Recorded when an upload is normalized, see posts/uploads.py
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    # Card variants for srcset and an inline preview, see posts/thumbnails.py
+    image_variants = models.TextField(blank=True, default='', editable=False)
+    image_preview = models.TextField(blank=True, default='', editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped whenever the rendered post changes; part of fragment cache keys
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
+        # One index per listing: filter by author/group, newest first. The
+        # id is the paginators' tiebreaker, without it they sort every page
+        indexes = [
+            models.Index(fields=['-pub_date', '-id']),
+            models.Index(fields=['author', '-pub_date', '-id']),
+            models.Index(fields=['group', '-pub_date', '-id']),
+        ]
 
     def __str__(self):
         return self.text
 
+    def save(self, *args, **kwargs):
+        bump = not self._state.adding
+        if bump:
+            # In the database: comments bump the version concurrently
+            self.version = models.F('version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version'}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post,
@@ -43,6 +84,10 @@ class Comment(models.Model):
     text = models.TextField()
     created = models.DateTimeField("date published", auto_now_add=True)
 
+    class Meta:
+        ordering = ('created',)
+        indexes = [models.Index(fields=['post', 'created', 'id'])]
+
     def __str__(self):
         return self.text
 
@@ -57,3 +102,63 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('user', 'author')
+        # Followers of an author without reading the table (fan-out)
+        indexes = [models.Index(fields=['author', 'user'])]
+
+
+class UserStats(models.Model):
+    """Denormalized counters shown next to a user's posts.
+
+    Kept in sync by signal handlers in `posts.signals`; run
+    `manage.py user_stats --verify` to check them against the tables.
+    """
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="stats")
+    post_count = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+    follows_count = models.PositiveIntegerField(default=0)
+
+
+class SearchPosting(models.Model):
+    """Inverted index entry: `term` occurs in the post's text or, when
+    `comment` is set, in one of its comments. Maintained by `posts.search`.
+    """
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name="search_postings")
+    comment = models.ForeignKey(Comment,
+                                blank=True,
+                                null=True,
+                                on_delete=models.CASCADE,
+                                related_name="search_postings")
+    weight = models.FloatField()
+
+    class Meta:
+        # Covers lookups: a query never has to read the table itself
+        indexes = [models.Index(fields=['term', 'post', 'weight'])]
+
+
+class TimelineEntry(models.Model):
+    """Materialized entry of a follower's home feed.
+
+    Every new post is pushed into the inbox of each follower of its author,
+    so `follow_index` reads a single user's rows instead of joining follows
+    against the whole posts table. Inboxes are trimmed to
+    `settings.TIMELINE_LENGTH` entries.
+    """
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="timeline")
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name="timeline_entries")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ('-pub_date', '-post')
+        unique_together = ('user', 'post')
+        # Covers reading a feed page in its order
+        indexes = [models.Index(fields=['user', '-pub_date', '-post'])]
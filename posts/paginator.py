@@ -0,0 +1,221 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+
+PER_PAGE = 10
+# Fields unique within a listing. `feed_post` is the post of a follow feed
+# entry, see `posts.timeline.feed`
+TIEBREAKERS = {'pk', 'id', 'feed_post'}
+# Integer cursor values past a 64 bit column cannot be bound by SQLite
+MAX_INTEGER = 2**63 - 1
+
+
+def get_ordering(queryset):
+    """Ordering of `queryset` with the primary key appended as tiebreaker."""
+    ordering = list(queryset.query.order_by
+                    or queryset.model._meta.ordering)
+    names = {field.lstrip('-') for field in ordering}
+    if not names & TIEBREAKERS:
+        descending = bool(ordering) and ordering[0].startswith('-')
+        ordering.append('-pk' if descending else 'pk')
+    return ordering
+
+
+def _serialize(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _field_value(obj, name):
+    # Rows of `.values()` querysets are paginated too
+    if isinstance(obj, dict):
+        return obj[name]
+    return getattr(obj, name)
+
+
+def encode_cursor(obj, ordering):
+    values = [
+        _serialize(_field_value(obj, field.lstrip('-')))
+        for field in ordering
+    ]
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _ordering_field(queryset, name):
+    """The model field or annotation output field sorted by `name`."""
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    if name == 'pk':
+        return queryset.model._meta.pk
+    return queryset.model._meta.get_field(name)
+
+
+def decode_cursor(token, ordering, queryset):
+    """The ordering values of a cursor of `queryset`, or None when the
+    cursor is not one this listing hands out."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    decoded = []
+    for field, value in zip(ordering, values):
+        field = _ordering_field(queryset, field.lstrip('-'))
+        try:
+            value = field.to_python(value)
+            if value is None:
+                return None
+            if isinstance(value, int) and abs(value) > MAX_INTEGER:
+                return None
+            decoded.append(field.get_prep_value(value))
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            return None
+    return decoded
+
+
+def keyset_filter(ordering, values, forward=True):
+    """Rows strictly after (or before) `values` in `ordering`."""
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        lookup = 'lt' if descending == forward else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<Cursor page of {len(self)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if self.object_list:
+            return encode_cursor(self.object_list[-1],
+                                 self.paginator.ordering)
+
+    @property
+    def previous_cursor(self):
+        if self.object_list:
+            return encode_cursor(self.object_list[0],
+                                 self.paginator.ordering)
+
+
+class CursorPaginator:
+    """Keyset paginator: seeks by the ordering values of the last row seen
+    instead of counting rows and skipping them with OFFSET."""
+
+    def __init__(self, object_list, per_page):
+        self.ordering = get_ordering(object_list)
+        self.object_list = object_list.order_by(*self.ordering)
+        self.per_page = per_page
+
+    def page(self, after=None, before=None):
+        token = after or before
+        values = token and decode_cursor(token, self.ordering,
+                                         self.object_list)
+        if not values:
+            rows = list(self.object_list[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, len(rows) >
+                              self.per_page, False)
+        if after:
+            rows = list(
+                self.object_list.filter(keyset_filter(
+                    self.ordering, values))[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, len(rows) >
+                              self.per_page, True)
+        rows = list(
+            self.object_list.filter(keyset_filter(
+                self.ordering, values,
+                forward=False)).reverse()[:self.per_page + 1])
+        return CursorPage(rows[:self.per_page][::-1], self, True,
+                          len(rows) > self.per_page)
+
+
+def _uncounted_page(paginator, rows, number, has_next, has_previous,
+                    ordering):
+    """A Django `Page` of rows fetched without counting the listing.
+
+    `Page` answers `has_next()` and friends from `paginator.count`, so they
+    are replaced with what the fetch already told.
+    """
+    page = Page(rows, number, paginator)
+    page.has_next = lambda: has_next
+    page.has_previous = lambda: has_previous
+    page.has_other_pages = lambda: has_next or has_previous
+    if rows:
+        page.next_cursor = encode_cursor(rows[-1], ordering)
+        page.previous_cursor = encode_cursor(rows[0], ordering)
+    return page
+
+
+def _page_number(value):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return 1
+
+
+def paginate(request, queryset, per_page=PER_PAGE):
+    """Returns `(paginator, page)` for a listing request.
+
+    Listings are paged by keyset cursors: the first page, then
+    `?after=`/`?before=` the cursors of its neighbours. An explicit
+    `?page=` still selects a numbered page, read with OFFSET. Nothing
+    counts the rows, so the paginator has no page range to show.
+    """
+    ordering = get_ordering(queryset)
+    queryset = queryset.order_by(*ordering)
+    paginator = Paginator(queryset, per_page)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if after or before or 'page' not in request.GET:
+        cursor_page = CursorPaginator(queryset, per_page).page(after=after,
+                                                               before=before)
+        return paginator, _uncounted_page(paginator,
+                                          cursor_page.object_list, 1,
+                                          cursor_page.has_next(),
+                                          cursor_page.has_previous(),
+                                          ordering)
+
+    number = _page_number(request.GET.get('page'))
+    offset = (number - 1) * per_page
+    rows = list(queryset[offset:offset + per_page + 1])
+    # Past the end there is nothing to go back to by cursor
+    return paginator, _uncounted_page(paginator, rows[:per_page], number,
+                                      len(rows) > per_page,
+                                      number > 1 and bool(rows), ordering)
@@ -0,0 +1,181 @@
+import math
+import re
+import sys
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, IntegerField, Max, Q, Sum, Value, When
+
+from .models import Comment, Post, SearchPosting
+
+TERM_LENGTH = 64
+MIN_TERM_LENGTH = 2
+# Matches in comments count for less than matches in the post itself
+COMMENT_WEIGHT = 0.3
+# Query words shorter than this match whole terms only, longer ones also
+# match as prefixes ("кот" finds "коты" and "котами")
+PREFIX_LENGTH = 3
+MAX_QUERY_TERMS = 8
+# Only this many of the newest posts matching every query word are ranked,
+# so a common word or prefix never aggregates the whole index
+MAX_CANDIDATES = 1000
+BATCH_SIZE = 500
+
+STOP_WORDS = frozenset("""
+    а без бы в во вы да для до же за и из или им их к как ко ли мы на не
+    ни но о об от по при с со та так то ты у уж что это я
+    a an and are as at be but by for from in is it of on or that the to
+    was were with
+""".split())
+
+WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return [
+        word[:TERM_LENGTH] for word in WORD_RE.findall(text.lower())
+        if len(word) >= MIN_TERM_LENGTH and word not in STOP_WORDS
+    ]
+
+
+def _weights(text, factor=1.0):
+    # Dampened term frequency: the tenth repetition adds little
+    return {
+        term: factor * (1 + math.log(count))
+        for term, count in Counter(tokenize(text)).items()
+    }
+
+
+def _postings(post_id, weights, comment_id=None):
+    return [
+        SearchPosting(term=term,
+                      post_id=post_id,
+                      comment_id=comment_id,
+                      weight=weight) for term, weight in weights.items()
+    ]
+
+
+def index_post(post):
+    with transaction.atomic():
+        SearchPosting.objects.filter(post=post, comment=None).delete()
+        SearchPosting.objects.bulk_create(
+            _postings(post.pk, _weights(post.text)))
+
+
+def index_comment(comment):
+    with transaction.atomic():
+        SearchPosting.objects.filter(comment=comment).delete()
+        SearchPosting.objects.bulk_create(
+            _postings(comment.post_id,
+                      _weights(comment.text, COMMENT_WEIGHT), comment.pk))
+
+
+def _all_postings(posts=None, comments=None):
+    if posts is None:
+        posts = Post.objects.all()
+    if comments is None:
+        comments = Comment.objects.all()
+    posts = posts.order_by().values_list('id', 'text')
+    for post_id, text in posts.iterator():
+        yield from _postings(post_id, _weights(text))
+    comments = comments.order_by().values_list('id', 'post_id', 'text')
+    for comment_id, post_id, text in comments.iterator():
+        yield from _postings(post_id, _weights(text, COMMENT_WEIGHT),
+                             comment_id)
+
+
+def reindex(post_ids=(), comment_ids=()):
+    """Replaces the postings of the given posts (without their comments)
+    and comments, e.g. after they were written in bulk."""
+    with transaction.atomic():
+        SearchPosting.objects.filter(post__in=post_ids,
+                                     comment=None).delete()
+        SearchPosting.objects.filter(comment__in=comment_ids).delete()
+        SearchPosting.objects.bulk_create(
+            _all_postings(Post.objects.filter(pk__in=post_ids),
+                          Comment.objects.filter(pk__in=comment_ids)),
+            batch_size=BATCH_SIZE)
+
+
+def rebuild():
+    """Reindexes everything; returns the number of postings written."""
+    written = 0
+    with transaction.atomic():
+        SearchPosting.objects.all().delete()
+        batch = []
+        for posting in _all_postings():
+            batch.append(posting)
+            if len(batch) == BATCH_SIZE:
+                SearchPosting.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        SearchPosting.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def _prefix_end(prefix):
+    """The smallest string greater than every string starting with
+    `prefix`, or None when there is none."""
+    while prefix:
+        last = ord(prefix[-1])
+        if last < sys.maxunicode:
+            return prefix[:-1] + chr(last + 1)
+        prefix = prefix[:-1]
+    return None
+
+
+def _term_condition(word):
+    if len(word) < PREFIX_LENGTH:
+        return Q(term=word)
+    # A range on the (term, ...) index rather than LIKE 'word%'
+    condition = Q(term__gte=word)
+    end = _prefix_end(word)
+    if end is not None:
+        condition &= Q(term__lt=end)
+    return condition
+
+
+def _candidates(words):
+    """Newest posts with postings of every word, intersected in SQL."""
+    # The longest word is usually the rarest, its postings are read first
+    words = sorted(words, key=len, reverse=True)
+    postings = SearchPosting.objects.filter(_term_condition(words[0]))
+    for word in words[1:]:
+        postings = postings.filter(post__in=SearchPosting.objects.filter(
+            _term_condition(word)).values('post'))
+    return postings.order_by('-post_id').values(
+        'post').distinct()[:MAX_CANDIDATES]
+
+
+def ranked_post_ids(query):
+    """Ids of posts matching every word of `query`, best matches first.
+
+    Returns a values queryset of `{'post', 'score'}` rows, or None for a
+    query without searchable words. Only the newest `MAX_CANDIDATES` posts
+    matching every word are ranked, see `is_truncated`.
+    """
+    words = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not words:
+        return None
+    matches_any = Q()
+    matched = {}
+    for number, word in enumerate(words):
+        condition = _term_condition(word)
+        matches_any |= condition
+        matched[f'matched_{number}'] = Max(
+            Case(When(condition, then=Value(1)),
+                 default=Value(0),
+                 output_field=IntegerField()))
+    return SearchPosting.objects.filter(
+        matches_any, post__in=_candidates(words)).values('post').annotate(
+            score=Sum('weight'),
+            **matched).filter(**{name: 1
+                                 for name in matched}).values(
+                                     'post',
+                                     'score').order_by('-score', '-post_id')
+
+
+def is_truncated(count):
+    """Whether `count` ranked posts may leave out older matches."""
+    return count >= MAX_CANDIDATES
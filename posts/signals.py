@@ -0,0 +1,141 @@
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import followgraph, search, stats, timeline
+from .caching import (bump_generation, bump_user_version, forget_user_id,
+                      mark_changed, remember_user_id)
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.push_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.increment(instance.author_id, 'post_count')
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    stats.decrement(instance.author_id, 'post_count')
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.increment(instance.author_id, 'follower_count')
+        stats.increment(instance.user_id, 'follows_count')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def refresh_follow_graph(sender, instance, **kwargs):
+    followgraph.changed(instance.user_id)
+
+
+@receiver(post_delete, sender=Follow)
+def evict_timeline(sender, instance, **kwargs):
+    timeline.evict(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    stats.decrement(instance.author_id, 'follower_count')
+    stats.decrement(instance.user_id, 'follows_count')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def refresh_profile_cards(sender, instance, **kwargs):
+    # Counters and follow buttons on both users' profile cards changed
+    bump_user_version(instance.author_id)
+    bump_user_version(instance.user_id)
+    mark_changed()
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1, version=F('version') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1, version=F('version') + 1)
+
+
+@receiver(post_save, sender=Group)
+def refresh_group_posts(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        instance.posts.update(version=F('version') + 1)
+
+
+@receiver(pre_delete, sender=Group)
+def refresh_ungrouped_posts(sender, instance, **kwargs):
+    # The posts lose their group with an UPDATE, not save()
+    instance.posts.update(version=F('version') + 1)
+
+
+@receiver(pre_save, sender=User)
+def refresh_renamed_author_posts(sender,
+                                 instance,
+                                 raw=False,
+                                 update_fields=None,
+                                 **kwargs):
+    if raw or instance.pk is None or (update_fields is not None
+                                      and 'username' not in update_fields):
+        return
+    username = User.objects.filter(pk=instance.pk).values_list(
+        'username', flat=True).first()
+    if username is not None and username != instance.username:
+        # Cards link to the profile URL of the old name
+        instance.posts.update(version=F('version') + 1)
+        bump_generation()
+        forget_user_id(username)
+
+
+@receiver(post_save, sender=User)
+def remember_username(sender, instance, raw=False, **kwargs):
+    if not raw:
+        remember_user_id(instance.username, instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def forget_username(sender, instance, **kwargs):
+    forget_user_id(instance.username)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_listings(sender, **kwargs):
+    bump_generation()
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_comment(instance)
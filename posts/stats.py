@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Follow, Post, User, UserStats
+
+COUNTERS = ('post_count', 'follower_count', 'follows_count')
+
+
+def count(user_id):
+    return {
+        'post_count': Post.objects.filter(author_id=user_id).count(),
+        'follower_count': Follow.objects.filter(author_id=user_id).count(),
+        'follows_count': Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def rebuild(user_id):
+    stats, _ = UserStats.objects.update_or_create(user_id=user_id,
+                                                  defaults=count(user_id))
+    return stats
+
+
+def for_user(user):
+    """Counters of `user`. A user nothing happened to yet has no row; their
+    counters are computed and left unsaved, the first change stores them."""
+    try:
+        return UserStats.objects.get(user=user)
+    except UserStats.DoesNotExist:
+        return UserStats(user=user, **count(user.id))
+
+
+def increment(user_id, counter):
+    change = {counter: F(counter) + 1}
+    if UserStats.objects.filter(user_id=user_id).update(**change):
+        return
+    # The first change: counted from the tables, which already include it
+    _, created = UserStats.objects.get_or_create(user_id=user_id,
+                                                 defaults=count(user_id))
+    if not created:
+        UserStats.objects.filter(user_id=user_id).update(**change)
+
+
+def decrement(user_id, counter):
+    UserStats.objects.filter(user_id=user_id, **{
+        f'{counter}__gt': 0
+    }).update(**{counter: F(counter) - 1})
+
+
+def _grouped(queryset, field):
+    rows = queryset.values(field).annotate(total=Count('id'))
+    return {row[field]: row['total'] for row in rows}
+
+
+def expected_counts():
+    """Actual counters of every user, computed with three grouped scans."""
+    posts = _grouped(Post.objects.order_by(), 'author')
+    followers = _grouped(Follow.objects.order_by(), 'author')
+    follows = _grouped(Follow.objects.order_by(), 'user')
+    for user_id in User.objects.values_list('id', flat=True).iterator():
+        yield user_id, {
+            'post_count': posts.get(user_id, 0),
+            'follower_count': followers.get(user_id, 0),
+            'follows_count': follows.get(user_id, 0),
+        }
+
+
+def rebuild_all():
+    """Replaces the counters of every user, e.g. after a bulk import."""
+    rows = [
+        UserStats(user_id=user_id, **counts)
+        for user_id, counts in expected_counts()
+    ]
+    with transaction.atomic():
+        UserStats.objects.all().delete()
+        UserStats.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
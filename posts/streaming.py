@@ -0,0 +1,51 @@
+"""Pages sent while they are rendered.
+
+`render_stream` renders a page without its `{% streamed %}` blocks, which
+leave a marker behind, and sends everything up to the first marker at
+once: the browser can fetch styles and scripts while the posts or
+comments are still being rendered. Each block is rendered when the
+response is consumed, with the variables it saw in the page. A block must
+not contain `{% block %}` tags. Rendered with `render()`, the blocks are
+plain template content.
+
+Blocks render after the middleware has finished with the response, so
+they cannot affect its headers; the CSRF token is issued up front for the
+forms inside them.
+"""
+import uuid
+
+from django.http import StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.template import loader
+
+CONTEXT_KEY = 'streamed_blocks'
+
+
+class StreamedBlocks:
+    def __init__(self):
+        # Random, so page content can never contain it
+        self.marker = f'<!-- streamed {uuid.uuid4().hex} -->'
+        self.blocks = []
+
+    def defer(self, nodelist, context):
+        self.blocks.append((nodelist, context))
+        return self.marker
+
+
+def _chunks(parts, blocks):
+    for part, (nodelist, context) in zip(parts, blocks):
+        yield part
+        yield nodelist.render(context)
+    yield parts[-1]
+
+
+def render_stream(request, template_name, context):
+    # Otherwise the CSRF cookie of a form in a block is never set
+    get_token(request)
+    streamed = StreamedBlocks()
+    page = loader.get_template(template_name).render(
+        {
+            **context, CONTEXT_KEY: streamed
+        }, request)
+    return StreamingHttpResponse(
+        _chunks(page.split(streamed.marker), streamed.blocks))
@@ -0,0 +1,84 @@
+from copy import copy
+
+from django import template
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags.cache import CacheNode
+
+from posts.fragments import render_post_items
+from posts.streaming import CONTEXT_KEY
+from posts.thumbnails import thumbnail_or_placeholder
+from yatube.routers import may_cache
+
+register = template.Library()
+# Set in the render context when a listing is not to be cached
+UNCACHEABLE_KEY = 'posts.uncacheable'
+
+
+@register.simple_tag(takes_context=True)
+def render_posts(context, posts):
+    html, complete = render_post_items(posts, context['user'])
+    if not complete:
+        context.render_context[UNCACHEABLE_KEY] = True
+    return html
+
+
+@register.simple_tag
+def post_thumbnail(post):
+    return thumbnail_or_placeholder(post)
+
+
+class StreamedNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        streamed = context.get(CONTEXT_KEY)
+        if streamed is None:
+            return self.nodelist.render(context)
+        # A copy, the page render pops its variables when it finishes
+        return streamed.defer(self.nodelist, copy(context))
+
+
+@register.tag
+def streamed(parser, token):
+    """Content rendered after the rest of the page when the page is sent
+    with `posts.streaming.render_stream`."""
+    nodelist = parser.parse(('endstreamed', ))
+    parser.delete_first_token()
+    return StreamedNode(nodelist)
+
+
+class ListingCacheNode(CacheNode):
+    """`{% cache %}` that leaves out listings whose cards were not cached
+    either, see `render_post_items`, and listings read from a replica that
+    may lag behind the generation in their key."""
+
+    def render(self, context):
+        expire_time = self.expire_time_var.resolve(context)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        value = cache.get(key)
+        if value is None:
+            context.render_context[UNCACHEABLE_KEY] = False
+            value = self.nodelist.render(context)
+            if may_cache() and not context.render_context.get(
+                    UNCACHEABLE_KEY):
+                cache.set(key, value, expire_time)
+        return value
+
+
+@register.tag
+def listing_cache(parser, token):
+    """Takes the timeout, fragment name and vary-on arguments of
+    `{% cache %}`."""
+    nodelist = parser.parse(('endlisting_cache', ))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(
+            f'{tokens[0]!r} tag requires at least 2 arguments.')
+    return ListingCacheNode(nodelist, parser.compile_filter(tokens[1]),
+                            tokens[2],
+                            [parser.compile_filter(t) for t in tokens[3:]],
+                            None)
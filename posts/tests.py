@@ -1,12 +1,38 @@
+import base64
+import gzip
 import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
 from collections.abc import Iterable
+from unittest import mock
 
 from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.templatetags.static import static
 from django.shortcuts import reverse
-from django.test import TestCase, Client, override_settings
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         Client, RequestFactory, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from PIL import Image
+from yatube import metrics, staticfiles
+from yatube.routers import (PIN_COOKIE, PrimaryReplicaRouter,
+                            ReplicaPinningMiddleware, may_cache)
+from yatube.sqlite_cache import SQLiteCache
 
-from .models import Post, User, Group, Follow
+from . import bulk, followgraph, search, signals, thumbnails, timeline
+from .caching import CHANGED_KEY, bump_generation
+from .models import (Comment, Post, User, Group, Follow, SearchPosting,
+                     TimelineEntry, UserStats)
 
 
 class TestScriptUser(TestCase):
@@ -199,13 +225,2024 @@ class TestScriptUser(TestCase):
         self.assertFormError(response, 'form', 'image', error)
 
     def test_caching(self):
-        _ = self.sarah_client.get(reverse('index'))
+        cache.clear()
+        post = Post.objects.create(text='cached text', author=self.sarah)
+        self.sarah_client.get(reverse('index'))
+
+        # Bypasses signals, so only the cached listing still has old text
+        Post.objects.filter(pk=post.pk).update(text='silent edit',
+                                               version=F('version') + 1)
+        cached_response = self.sarah_client.get(reverse('index'))
+        self.assertContains(cached_response, 'cached text')
 
         post_text = 'test caching'
         self.sarah_client.post(reverse('new_post'), {
             'text': post_text,
         }, follow=True)
 
-        cached_response = self.sarah_client.get(reverse('index'))
+        fresh_response = self.sarah_client.get(reverse('index'))
+        self.assertContains(fresh_response, post_text)
+        self.assertContains(fresh_response, 'silent edit')
+
+    def test_cached_fragments_vary_by_page(self):
+        cache.clear()
+        for i in range(11):
+            Post.objects.create(text=f'paged post {i}', author=self.sarah)
+        self.sarah_client.get(reverse('index'))
+
+        response = self.sarah_client.get(reverse('index'), {'page': 2})
+        self.assertContains(response, 'paged post 0')
+        self.assertNotContains(response, 'paged post 10')
+
+        group_post = Post.objects.create(text='in group',
+                                         author=self.sarah,
+                                         group=self.group)
+        response = self.sarah_client.get(
+            reverse('group_posts', args=[self.group.slug]))
+        self.assertContains(response, group_post.text)
+        self.assertNotContains(response, 'paged post')
+
+
+class TestTimeline(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username="reader")
+        self.author = User.objects.create_user(username="writer")
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def inbox(self):
+        return list(TimelineEntry.objects.filter(
+            user=self.reader).values_list('post_id', flat=True))
+
+    def test_new_post_is_pushed_to_followers(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text="fan-out", author=self.author)
+        self.assertEqual(self.inbox(), [post.id])
+
+        response = self.client.get(reverse('follow_index'))
+        self.assertIn(post, response.context['page'])
+
+    def test_follow_backfills_and_unfollow_evicts(self):
+        old_post = Post.objects.create(text="old", author=self.author)
+        self.client.get(reverse('profile_follow',
+                                args=[self.author.username]))
+        self.assertEqual(self.inbox(), [old_post.id])
+
+        self.client.get(reverse('profile_unfollow',
+                                args=[self.author.username]))
+        self.assertEqual(self.inbox(), [])
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_inbox_is_bounded(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        posts = [
+            Post.objects.create(text=str(i), author=self.author)
+            for i in range(3)
+        ]
+        self.assertEqual(self.inbox(), [posts[2].id, posts[1].id])
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_trim_only_cuts_inboxes_over_the_limit(self):
+        fan = User.objects.create_user(username="fan")
+        for user in (self.reader, fan):
+            Follow.objects.create(user=user, author=self.author)
+        posts = [
+            Post.objects.create(text=str(i), author=self.author)
+            for i in range(3)
+        ]
+        # Same date everywhere: the post id decides
+        date = timezone.now()
+        TimelineEntry.objects.all().delete()
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user=self.reader, post=post, pub_date=date)
+             for post in posts] +
+            [TimelineEntry(user=fan, post=posts[0], pub_date=date)])
+
+        timeline.trim_followers(self.author.id)
+        self.assertEqual(sorted(self.inbox()), [posts[1].id, posts[2].id])
+        self.assertEqual(
+            list(fan.timeline.values_list('post_id', flat=True)),
+            [posts[0].id])
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_push_cost_does_not_grow_with_followers(self):
+        posts = [Post.objects.create(text="0", author=self.author)]
+        Follow.objects.create(user=self.reader, author=self.author)
+        with CaptureQueriesContext(connection) as one_follower:
+            posts.append(Post.objects.create(text="1", author=self.author))
+        for number in range(5):
+            follower = User.objects.create_user(username=f"fan{number}")
+            Follow.objects.create(user=follower, author=self.author)
+        with CaptureQueriesContext(connection) as many_followers:
+            posts.append(Post.objects.create(text="2", author=self.author))
+        posts.append(Post.objects.create(text="3", author=self.author))
+        self.assertEqual(len(many_followers), len(one_follower))
+        self.assertEqual(self.inbox(), [posts[3].id, posts[2].id])
+        fan = User.objects.get(username="fan0")
+        self.assertEqual(
+            list(fan.timeline.values_list('post_id', flat=True)),
+            [posts[3].id, posts[2].id])
+
+    def test_rebuild_command(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text="repair me", author=self.author)
+        TimelineEntry.objects.all().delete()
+
+        call_command('rebuild_timelines', self.reader.username,
+                     stdout=io.StringIO())
+        self.assertEqual(self.inbox(), [post.id])
+
+
+def _cursor(*values):
+    data = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+# Well-formed cursors whose values do not fit the ordering fields
+WRONG_TYPED_CURSORS = [
+    _cursor('garbage', 1),
+    _cursor({'x': 1}, 1),
+    _cursor('2020-01-01T00:00:00', 'abc'),
+    _cursor(None, 1),
+    _cursor('2020-01-01T00:00:00', 2**70),
+]
+
+
+class TestCursorPagination(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="writer")
+        self.posts = [
+            Post.objects.create(text=f"post {i}", author=self.author)
+            for i in range(25)
+        ]
+        self.posts.reverse()
+
+    def test_cursor_pages_follow_numbered_pages(self):
+        client = Client()
+        first = client.get(reverse('index')).context['page']
+        self.assertEqual(list(first), self.posts[:10])
+
+        second = client.get(reverse('index'),
+                            {'after': first.next_cursor}).context['page']
+        self.assertEqual(list(second), self.posts[10:20])
+        self.assertTrue(second.has_previous())
+
+        third = client.get(reverse('index'),
+                           {'after': second.next_cursor}).context['page']
+        self.assertEqual(list(third), self.posts[20:])
+        self.assertFalse(third.has_next())
+
+        back = client.get(reverse('index'),
+                          {'before': third.previous_cursor}).context['page']
+        self.assertEqual(list(back), self.posts[10:20])
+
+    def test_listings_are_not_counted(self):
+        with CaptureQueriesContext(connection) as context:
+            response = Client().get(reverse('index'))
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in context.captured_queries))
+        self.assertTrue(response.context['page'].has_next())
+        self.assertNotContains(response, 'page=')
+
+    def test_numbered_page_fallback(self):
+        client = Client()
+        with CaptureQueriesContext(connection) as context:
+            page = client.get(reverse('index'), {'page': 3}).context['page']
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in context.captured_queries))
+        self.assertEqual(list(page), self.posts[20:])
+        self.assertTrue(page.has_previous())
+        self.assertFalse(page.has_next())
+        back = client.get(reverse('index'),
+                          {'before': page.previous_cursor}).context['page']
+        self.assertEqual(list(back), self.posts[10:20])
+
+        past_end = client.get(reverse('index'), {'page': 9}).context['page']
+        self.assertEqual(list(past_end), [])
+        self.assertFalse(past_end.has_other_pages())
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        response = Client().get(reverse('index'), {'after': 'garbage'})
+        self.assertEqual(list(response.context['page']), self.posts[:10])
+        self.assertFalse(response.context['page'].has_previous())
+
+    def test_wrong_typed_cursor_falls_back_to_first_page(self):
+        reader = User.objects.create_user(username="reader")
+        Follow.objects.create(user=reader, author=self.author)
+        client = Client()
+        client.force_login(reader)
+        for url in [
+                reverse('index'),
+                reverse('profile', args=['writer']),
+                reverse('follow_index')
+        ]:
+            for cursor in WRONG_TYPED_CURSORS:
+                for name in ('after', 'before'):
+                    with self.subTest(url=url, cursor=cursor, name=name):
+                        response = client.get(url, {name: cursor})
+                        self.assertEqual(list(response.context['page']),
+                                         self.posts[:10])
+
+    def test_follow_feed_cursor(self):
+        reader = User.objects.create_user(username="reader")
+        Follow.objects.create(user=reader, author=self.author)
+        client = Client()
+        client.force_login(reader)
+
+        first = client.get(reverse('follow_index')).context['page']
+        response = client.get(reverse('follow_index'),
+                              {'after': first.next_cursor})
+        self.assertEqual(list(response.context['page']), self.posts[10:20])
+        self.assertContains(response, '?before=')
+
+
+class TestUserStats(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="writer")
+        self.reader = User.objects.create_user(username="reader")
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def counters(self, user):
+        user.stats.refresh_from_db()
+        return (user.stats.post_count, user.stats.follower_count,
+                user.stats.follows_count)
+
+    def test_counters_follow_writes(self):
+        post = Post.objects.create(text="counted", author=self.author)
+        self.client.get(reverse('profile_follow',
+                                args=[self.author.username]))
+        self.assertEqual(self.counters(self.author), (1, 1, 0))
+        self.assertEqual(self.counters(self.reader), (0, 0, 1))
+
+        self.client.get(reverse('profile_unfollow',
+                                args=[self.author.username]))
+        post.delete()
+        self.assertEqual(self.counters(self.author), (0, 0, 0))
+        self.assertEqual(self.counters(self.reader), (0, 0, 0))
+
+    def test_profile_reads_stored_counters(self):
+        Post.objects.create(text="counted", author=self.author)
+        response = self.client.get(
+            reverse('profile', args=[self.author.username]))
+        self.assertEqual(response.context['post_count'], 1)
+        self.assertEqual(response.context['follower_count'], 0)
+
+    def test_profile_get_does_not_write(self):
+        Follow.objects.bulk_create(
+            [Follow(user=self.reader, author=self.author)])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('profile', args=[self.author.username]))
+        self.assertEqual(response.context['follower_count'], 1)
+        self.assertFalse(UserStats.objects.filter(user=self.author).exists())
+        self.assertFalse(any(
+            query['sql'].startswith(('INSERT', 'UPDATE'))
+            and 'posts_userstats' in query['sql']
+            for query in context.captured_queries))
+
+    def test_first_change_counts_existing_rows(self):
+        Follow.objects.bulk_create(
+            [Follow(user=self.reader, author=self.author)])
+        Post.objects.create(text="counted", author=self.author)
+        self.assertEqual(self.counters(self.author), (1, 1, 0))
+        Post.objects.create(text="counted", author=self.author)
+        self.assertEqual(self.counters(self.author), (2, 1, 0))
+
+    def test_verify_and_rebuild_command(self):
+        Post.objects.create(text="counted", author=self.author)
+        UserStats.objects.filter(user=self.author).update(post_count=7)
+
+        with self.assertRaises(CommandError):
+            call_command('user_stats', '--verify', stdout=io.StringIO())
+        call_command('user_stats', stdout=io.StringIO())
+        call_command('user_stats', '--verify', stdout=io.StringIO())
+        self.assertEqual(self.counters(self.author), (1, 0, 0))
+
+    def test_verify_accepts_users_without_stats_row(self):
+        User.objects.create_user(username="newcomer")
+        out = io.StringIO()
+        call_command('user_stats', '--verify', stdout=out)
+        self.assertIn('All counters in sync', out.getvalue())
+
+        Follow.objects.bulk_create(
+            [Follow(user=self.reader, author=self.author)])
+        with self.assertRaises(CommandError):
+            call_command('user_stats', '--verify', stdout=io.StringIO())
+
+
+class TestCommentCount(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.group = Group.objects.create(title='Counted', slug='counted')
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def create_post(self):
+        post = Post.objects.create(text="post",
+                                   author=self.author,
+                                   group=self.group)
+        Comment.objects.create(post=post, author=self.author, text="hi")
+        return post
+
+    def test_comment_count_follows_writes(self):
+        post = Post.objects.create(text="post", author=self.author)
+        self.client.post(reverse('add_comment',
+                                 args=[self.author.username, post.id]),
+                         {'text': 'first'})
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+        post.comments.get().delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+
+    def test_rebuilt_comment_count_gets_a_new_version(self):
+        post = Post.objects.create(text="post", author=self.author)
+        Comment.objects.bulk_create(
+            [Comment(post=post, author=self.author, text="bulk")])
+        version = post.version
+        bulk.rebuild_comment_counts([post.id])
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(post.version, version + 1)
+
+    def test_listing_queries_do_not_depend_on_page_size(self):
+        urls = [
+            reverse('index'),
+            reverse('group_posts', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+        ]
+        self.create_post()
+        queries = {}
+        for url in urls:
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(url)
+            queries[url] = len(context)
+
+        for _ in range(9):
+            self.create_post()
+        for url in urls:
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertContains(response, '1 комментариев', count=10)
+            self.assertEqual(len(context), queries[url], url)
+
+
+class TestFeedQueries(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.group = Group.objects.create(title='Feed', slug='feed')
+        for i in range(15):
+            Post.objects.create(text=f"post {i}",
+                                author=self.author,
+                                group=self.group)
+        self.reader = User.objects.create_user(username="reader")
+        Follow.objects.create(user=self.reader, author=self.author)
+        followgraph.following_ids(self.reader.id)
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.post = Post.objects.first()
+
+    def test_query_budget(self):
+        budgets = [
+            # session, user, posts
+            (reverse('index'), 3),
+            (reverse('follow_index'), 3),
+            # session, user, group, posts
+            (reverse('group_posts', args=[self.group.slug]), 4),
+            # session, user, author, stats, posts
+            (reverse('profile', args=[self.author.username]), 5),
+            # session, user, post, stats, comments
+            (reverse('post', args=[self.author.username, self.post.id]), 5),
+        ]
+        for url, budget in budgets:
+            with self.subTest(url=url), self.assertNumQueries(budget):
+                self.client.get(url)
+
+
+class TestPostFragments(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.reader = User.objects.create_user(username="reader")
+        self.post = Post.objects.create(text="fragment", author=self.author)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def get_index(self, client):
+        # Skip the listing-level fragment to exercise per-post caching
+        bump_generation()
+        return client.get(reverse('index'))
+
+    def test_cached_cards_are_not_rendered_again(self):
+        response = self.get_index(self.reader_client)
+        self.assertTemplateUsed(response, 'post_item.html')
+
+        response = self.get_index(self.reader_client)
+        self.assertTemplateNotUsed(response, 'post_item.html')
+        self.assertContains(response, self.post.text)
+
+    def test_edit_link_only_for_author(self):
+        edit_url = reverse('post_edit',
+                           args=[self.author.username, self.post.id])
+        self.assertContains(self.get_index(self.author_client), edit_url)
+        self.assertNotContains(self.get_index(self.reader_client), edit_url)
+        self.assertContains(self.get_index(self.author_client), edit_url)
+
+    def test_new_version_is_rendered(self):
+        self.get_index(self.reader_client)
+        self.post.text = "edited"
+        self.post.save()
+        self.assertContains(self.get_index(self.reader_client), "edited")
+
+        Comment.objects.create(post=self.post, author=self.reader, text="!")
+        self.assertContains(self.get_index(self.reader_client),
+                            "1 комментариев")
+
+    def test_edit_after_comment_gets_a_new_version(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(post=self.post, author=self.reader, text="!")
+        stale.text = "edited"
+        stale.save()
+        self.assertEqual(stale.version, 3)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).version, 3)
+
+    def test_deleted_group_is_not_linked(self):
+        group = Group.objects.create(title='Gone', slug='gone')
+        self.post.group = group
+        self.post.save()
+        group_url = reverse('group_posts', args=[group.slug])
+        self.assertContains(self.get_index(self.reader_client), group_url)
+        group.delete()
+        self.assertNotContains(self.get_index(self.reader_client), group_url)
+
+    def test_renamed_author_is_linked(self):
+        self.get_index(self.reader_client)
+        self.author.username = "renamed"
+        self.author.save()
+        response = self.reader_client.get(reverse('index'))
+        self.assertContains(response, reverse('profile', args=['renamed']))
+
+
+class TestSQLiteCache(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, 'cache.sqlite3')
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_basic_operations_are_shared(self):
+        worker_1, worker_2 = self.make_cache(), self.make_cache()
+        worker_1.set('text', 'hello')
+        worker_1.set_many({'a': [1], 'b': {'c': 2}})
+        self.assertEqual(worker_2.get('text'), 'hello')
+        self.assertEqual(worker_2.get_many(['a', 'b', 'missing']), {
+            'a': [1],
+            'b': {
+                'c': 2
+            }
+        })
+        self.assertFalse(worker_2.add('text', 'other'))
+        worker_2.delete('text')
+        self.assertIsNone(worker_1.get('text'))
+
+    def test_incr_is_shared(self):
+        worker_1, worker_2 = self.make_cache(), self.make_cache()
+        with self.assertRaises(ValueError):
+            worker_1.incr('generation')
+        worker_1.set('generation', 10)
+        self.assertEqual(worker_2.incr('generation'), 11)
+        self.assertEqual(worker_1.incr('generation', 5), 16)
+        self.assertEqual(worker_2.decr('generation'), 15)
+
+    def test_expired_entries_are_misses(self):
+        cache_backend = self.make_cache()
+        cache_backend.set('short', 'lived', timeout=0)
+        self.assertIsNone(cache_backend.get('short'))
+        self.assertTrue(cache_backend.add('short', 'again'))
+
+    def test_least_recently_used_are_evicted(self):
+        cache_backend = self.make_cache(MAX_ENTRIES=4,
+                                        CULL_FREQUENCY=4,
+                                        CULL_CHECK_INTERVAL=1)
+        for key in 'abcd':
+            cache_backend.set(key, key)
+            time.sleep(0.01)
+        # Make `a` the most recently used entry
+        cache_backend._connection.execute(
+            "UPDATE cache SET accessed = ? WHERE key = ':1:a'",
+            (time.time(), ))
+        cache_backend.set('e', 'e')
+        self.assertEqual(
+            set(cache_backend.get_many('abcde')), {'a', 'c', 'd', 'e'})
+
+
+class TestThumbnailPipeline(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.post = Post.objects.create(text="picture",
+                                        author=self.author,
+                                        image='posts/picture.png')
+
+    def test_placeholder_until_thumbnail_exists(self):
+        with mock.patch('posts.thumbnails._submit') as submit:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'src="data:image/svg+xml')
+        submit.assert_called_once_with(self.post.pk, 'posts/picture.png')
+
+        thumbnail = mock.Mock(url='/media/cache/thumb.jpg')
+        with mock.patch('posts.thumbnails.cached_thumbnails',
+                        return_value={'posts/picture.png': thumbnail}):
+            self.post.save()
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'src="/media/cache/thumb.jpg"')
+
+    def test_recorded_thumbnail_replaces_placeholder_card(self):
+        with mock.patch('posts.thumbnails._submit') as submit:
+            response = self.client.get(reverse('index'))
+            self.assertContains(response, 'src="data:image/svg+xml')
+            # Rendered again, so a lost job is submitted again
+            self.client.get(reverse('index'))
+        self.assertEqual(submit.call_count, 2)
+
+        # Recorded without a new post version, e.g. by another worker
+        thumbnail = mock.Mock(width=960, height=339)
+        thumbnail.name = 'cache/thumb.jpg'
+        thumbnails._remember('posts/picture.png', 'card', thumbnail)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'src="/media/cache/thumb.jpg"')
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_generation_refreshes_cached_cards(self):
+        version = self.post.version
+        thumbnail = mock.Mock(width=960, height=339)
+        thumbnail.name = 'cache/card.jpg'
+        with mock.patch('posts.thumbnails.get_thumbnail',
+                        return_value=thumbnail) as get_thumbnail, \
+                mock.patch('posts.thumbnails.image_variants',
+                           return_value=('[]', '')), \
+                mock.patch('posts.thumbnails.default.storage.exists',
+                           return_value=True):
+            self.assertTrue(
+                thumbnails.generate(self.post.pk, 'posts/picture.png'))
+        get_thumbnail.assert_called_once_with('posts/picture.png',
+                                              '960x339',
+                                              crop='center',
+                                              upscale=True)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, version + 1)
+        recorded = thumbnails.cached_thumbnail('posts/picture.png')
+        self.assertEqual(recorded.url, '/media/cache/card.jpg')
+
+    def test_page_is_resolved_with_one_lookup(self):
+        posts = [self.post] + [
+            Post.objects.create(text=str(i),
+                                author=self.author,
+                                image=f'posts/picture_{i}.png')
+            for i in range(3)
+        ]
+        for post in posts[:3]:
+            thumbnail = mock.Mock(width=960, height=339)
+            thumbnail.name = f'cache/{post.pk}.jpg'
+            thumbnails._remember(post.image.name, 'card', thumbnail)
+        before = thumbnails.resolver_stats()
+
+        with mock.patch('posts.thumbnails._submit') as submit, \
+                mock.patch.object(cache, 'get_many',
+                                  wraps=cache.get_many) as get_many, \
+                self.assertNumQueries(0):
+            resolved = thumbnails.resolve_thumbnails(posts)
+        get_many.assert_called_once()
+        submit.assert_called_once_with(posts[3].pk, posts[3].image.name)
+        self.assertIsInstance(resolved[posts[3].pk], thumbnails.Placeholder)
+        self.assertEqual(resolved[posts[0].pk].url,
+                         f'/media/cache/{posts[0].pk}.jpg')
+
+        stats = thumbnails.resolver_stats()
+        self.assertEqual(stats['hits'] - before.get('hits', 0), 3)
+        self.assertEqual(stats['misses'] - before.get('misses', 0), 1)
+
+    @override_settings(THUMBNAIL_WORKERS=0, THUMBNAIL_RETRY_DELAY=60)
+    def test_failed_images_are_retried_after_a_delay(self):
+        image = 'posts/broken.png'
+        with mock.patch('posts.thumbnails.generate',
+                        return_value=False) as generate, \
+                mock.patch('posts.thumbnails.time.monotonic',
+                           return_value=1000):
+            thumbnails._submit(self.post.pk, image)
+            thumbnails._submit(self.post.pk, image)
+        self.assertEqual(generate.call_count, 1)
+        self.assertNotIn(image, thumbnails._pending)
+
+        with mock.patch('posts.thumbnails.generate',
+                        return_value=True) as generate, \
+                mock.patch('posts.thumbnails.time.monotonic',
+                           return_value=1061):
+            thumbnails._submit(self.post.pk, image)
+            thumbnails._submit(self.post.pk, image)
+        self.assertEqual(generate.call_count, 2)
+        self.assertNotIn(image, thumbnails._failed)
+
+    def test_queued_image_is_submitted_once(self):
+        image = 'posts/queued.png'
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_generate(post_id, image_name):
+            started.set()
+            release.wait(5)
+            return True
+
+        with override_settings(THUMBNAIL_WORKERS=2), \
+                mock.patch('posts.thumbnails.generate',
+                           side_effect=slow_generate) as generate, \
+                mock.patch('posts.thumbnails.connections'):
+            thumbnails._submit(self.post.pk, image)
+            started.wait(5)
+            thumbnails._submit(self.post.pk, image)
+            release.set()
+            thumbnails._get_executor().submit(lambda: None).result(5)
+        self.assertEqual(generate.call_count, 1)
+
+
+class TestImageVariants(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.directory.name)
+        self.settings.enable()
+        self.author = User.objects.create_user(username="writer")
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def fake_thumbnail(self, image_name, geometry, **options):
+        width, height = map(int, geometry.split('x'))
+        thumbnail = mock.Mock(width=width, height=height)
+        thumbnail.name = f'cache/{width}.jpg'
+        return thumbnail
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_generation_stores_variants_and_preview(self):
+        os.makedirs(os.path.join(self.directory.name, 'posts'))
+        Image.new('RGB', (700, 500), 'blue').save(
+            os.path.join(self.directory.name, 'posts', 'wide.jpg'))
+        post = Post.objects.create(text="wide",
+                                   author=self.author,
+                                   image='posts/wide.jpg')
+        with mock.patch('posts.thumbnails.get_thumbnail',
+                        side_effect=self.fake_thumbnail):
+            thumbnails.generate(post.pk, 'posts/wide.jpg')
+        post.refresh_from_db()
+        # Nothing wider than the 700 pixel source
+        self.assertEqual(json.loads(post.image_variants),
+                         [['cache/320.jpg', 320, 113],
+                          ['cache/480.jpg', 480, 170],
+                          ['cache/640.jpg', 640, 226]])
+        prefix = 'data:image/jpeg;base64,'
+        self.assertTrue(post.image_preview.startswith(prefix))
+        preview = base64.b64decode(post.image_preview[len(prefix):])
+        with Image.open(io.BytesIO(preview)) as image:
+            self.assertEqual(image.size, thumbnails.PREVIEW_SIZE)
+
+    def test_cards_use_stored_variants(self):
+        Post.objects.create(text="wide",
+                            author=self.author,
+                            image='posts/wide.jpg',
+                            image_variants=json.dumps(
+                                [['cache/320.jpg', 320, 113],
+                                 ['cache/640.jpg', 640, 226]]),
+                            image_preview='data:image/jpeg;base64,AAAA')
+        with mock.patch('posts.thumbnails.cached_thumbnails',
+                        return_value={}) as lookup:
+            response = self.client.get(reverse('index'))
+        lookup.assert_called_once_with([], 'card')
+        self.assertContains(
+            response, 'srcset="/media/cache/320.jpg 320w, '
+            '/media/cache/640.jpg 640w"')
+        self.assertContains(response, 'src="/media/cache/640.jpg"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, "url('data:image/jpeg;base64,AAAA')")
+
+    def test_card_without_variants_shows_the_original(self):
+        Post.objects.create(text="bare",
+                            author=self.author,
+                            image='posts/bare.jpg',
+                            image_variants='[]',
+                            image_preview='')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'src="/media/posts/bare.jpg"')
+        self.assertNotContains(response, 'srcset=')
+
+    def test_new_image_drops_old_variants(self):
+        post = Post.objects.create(text="old",
+                                   author=self.author,
+                                   image='posts/old.jpg',
+                                   image_variants='[]',
+                                   image_preview='data:')
+        client = Client()
+        client.force_login(self.author)
+        image = io.BytesIO()
+        Image.new('RGB', (20, 20)).save(image, 'PNG')
+        image.name = 'new.png'
+        image.seek(0)
+        client.post(reverse('post_edit', args=[self.author.username, post.id]),
+                    {
+                        'text': 'new',
+                        'image': image
+                    })
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, 'posts/new.jpg')
+        self.assertEqual((post.image_variants, post.image_preview), ('', ''))
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.client = Client()
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('search'), {'q': query, **params})
+        return [post.text for post in response.context['page'] or []]
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('Кот и КОТЫ, the cat!'),
+                         ['кот', 'коты', 'cat'])
+
+    def test_every_word_must_match(self):
+        Post.objects.create(text="рыжий кот спит", author=self.author)
+        Post.objects.create(text="рыжий пёс бегает", author=self.author)
+        self.assertEqual(self.search('рыжий кот'), ['рыжий кот спит'])
+        self.assertEqual(len(self.search('рыжий')), 2)
+        self.assertEqual(self.search('и'), [])
+
+    def test_prefix_match_and_ranking(self):
+        Post.objects.create(text="котики", author=self.author)
+        Post.objects.create(text="кот кот кот", author=self.author)
+        post = Post.objects.create(text="про собак", author=self.author)
+        Comment.objects.create(post=post, author=self.author, text="кот")
+        self.assertEqual(self.search('кот'),
+                         ["кот кот кот", "котики", "про собак"])
+
+    def test_prefix_of_characters_outside_the_bmp(self):
+        Post.objects.create(text="𝔸𝔹𝔻𝔼 формулы", author=self.author)
+        self.assertEqual(self.search('𝔸𝔹𝔻'), ["𝔸𝔹𝔻𝔼 формулы"])
+        self.assertEqual(search._prefix_end('аб' + chr(sys.maxunicode)),
+                         'ав')
+
+    def test_ranking_is_bounded_to_newest_candidates(self):
+        for i in range(3):
+            Post.objects.create(text=f"частое слово {i}", author=self.author)
+        with mock.patch('posts.search.MAX_CANDIDATES', 2), \
+                CaptureQueriesContext(connection) as context:
+            found = self.search('частое')
+        self.assertEqual(sorted(found), ["частое слово 1", "частое слово 2"])
+        self.assertTrue(all('LIMIT 2' in query['sql']
+                            for query in context.captured_queries
+                            if 'posts_searchposting' in query['sql']))
+
+    def test_older_posts_matching_every_word_are_ranked(self):
+        Post.objects.create(text="редкое частое", author=self.author)
+        for i in range(3):
+            Post.objects.create(text=f"частое слово {i}", author=self.author)
+        with mock.patch('posts.search.MAX_CANDIDATES', 2):
+            self.assertEqual(self.search('частое редкое'),
+                             ["редкое частое"])
+            response = self.client.get(reverse('search'), {'q': 'частое'})
+        self.assertContains(response, 'показаны 2 самых новых')
+        response = self.client.get(reverse('search'), {'q': 'редкое'})
+        self.assertNotContains(response, 'самых новых')
+
+    def test_index_follows_edits(self):
+        post = Post.objects.create(text="старый текст", author=self.author)
+        comment = Comment.objects.create(post=post,
+                                         author=self.author,
+                                         text="комментарий")
+        post.text = "новый текст"
+        post.save()
+        self.assertEqual(self.search('старый'), [])
+        self.assertEqual(self.search('новый'), ["новый текст"])
+        self.assertEqual(self.search('комментарий'), ["новый текст"])
+
+        comment.delete()
+        self.assertEqual(self.search('комментарий'), [])
+
+    def test_results_are_paginated(self):
+        for i in range(12):
+            Post.objects.create(text=f"заметка {i}", author=self.author)
+        self.assertEqual(len(self.search('заметка')), 10)
+        response = self.client.get(reverse('search'), {'q': 'заметка'})
+        self.assertContains(response, '?q=%D0%B7%D0%B0%D0%BC%D0%B5%D1%82'
+                            '%D0%BA%D0%B0&amp;page=2')
+        self.assertEqual(len(self.search('заметка', page=2)), 2)
+
+    def test_rebuild(self):
+        post = Post.objects.create(text="текст поста", author=self.author)
+        Comment.objects.create(post=post, author=self.author, text="ответ")
+        SearchPosting.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 search postings', out.getvalue())
+        self.assertEqual(self.search('ответ'), ["текст поста"])
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser('admin', 'a@example.com', 'pw')
+        self.client.force_login(admin)
+        Post.objects.create(text="найди меня", author=self.author)
+        Post.objects.create(text="другое", author=self.author)
+        response = self.client.get('/admin/posts/post/', {'q': 'найди'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class TestQueryPlans(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        reader = User.objects.create_user(username="reader")
+        group = Group.objects.create(title='Plans', slug='plans')
+        for i in range(3):
+            post = Post.objects.create(text=f"post {i}",
+                                       author=self.author,
+                                       group=group)
+        Comment.objects.create(post=post, author=reader, text="comment")
+        Follow.objects.create(user=reader, author=self.author)
+
+    def test_views_are_indexed(self):
+        out = io.StringIO()
+        call_command('explain_views', stdout=out)
+        self.assertIn('profile: ', out.getvalue())
+        self.assertRegex(out.getvalue(),
+                         r'follow_index: \d+ queries, all indexed')
+        self.assertIn('No unexpected scans or sorts', out.getvalue())
+
+    def test_unindexed_view_fails(self):
+        with mock.patch.object(Post._meta, 'ordering', ('text', )):
+            with self.assertRaises(CommandError):
+                call_command('explain_views', stdout=io.StringIO())
+
+
+class TestSyntheticData(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def generate(self):
+        call_command('generate_data',
+                     '--users=20',
+                     '--groups=3',
+                     '--posts=200',
+                     '--follows=3',
+                     '--comments=100',
+                     stdout=io.StringIO())
+
+    def test_generate_data(self):
+        self.generate()
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        # Derived data is rebuilt after the bulk inserts
+        out = io.StringIO()
+        call_command('user_stats', '--verify', stdout=out)
+        self.assertIn('All counters in sync', out.getvalue())
+        self.assertEqual(
+            sum(Post.objects.values_list('comment_count', flat=True)), 100)
+        self.assertEqual(TimelineEntry.objects.count(),
+                         Post.objects.filter(author__following__isnull=False)
+                         .count())
+        self.assertTrue(SearchPosting.objects.exists())
+        # Dates are spread out rather than all set to now
+        self.assertGreater(Post.objects.dates('pub_date', 'day').count(), 30)
+
+        with self.assertRaises(CommandError):
+            self.generate()
+
+    def test_benchmark_baseline(self):
+        self.generate()
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'baseline.json')
+            out = io.StringIO()
+            call_command('benchmark_views',
+                         '--requests=2',
+                         '--warmup=0',
+                         f'--save={baseline}',
+                         stdout=out)
+            self.assertIn('signup', out.getvalue())
+            with open(baseline) as saved:
+                routes = json.load(saved)['routes']
+            self.assertEqual(routes['index']['queries'], 3)
+            self.assertGreater(routes['index']['bytes'], 0)
+
+            routes['index']['queries'] -= 1
+            with open(baseline, 'w') as saved:
+                json.dump({'routes': routes}, saved)
+            with self.assertRaisesMessage(CommandError, 'index'):
+                call_command('benchmark_views',
+                             '--requests=2',
+                             f'--compare={baseline}',
+                             '--threshold=1000',
+                             stdout=io.StringIO())
+
+
+class TestImportContent(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.reader = User.objects.create_user(username="reader")
+        self.group = Group.objects.create(title='Imported', slug='imported')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file_:
+            file_.write(content)
+        return path
+
+    def test_import(self):
+        posts = self.write(
+            'posts.jsonl', '\n'.join([
+                json.dumps({
+                    'id': 10,
+                    'author': 'writer',
+                    'group': 'imported',
+                    'text': 'первый',
+                    'pub_date': '2019-05-01T12:00:00'
+                }),
+                json.dumps({
+                    'id': 11,
+                    'author': 'writer',
+                    'text': 'второй'
+                }),
+                json.dumps({
+                    'id': 12,
+                    'author': 'nobody',
+                    'text': 'чужой'
+                }),
+                '{broken',
+                json.dumps({
+                    'author': 'writer',
+                    'text': 'без ключа'
+                }),
+            ]))
+        comments = self.write(
+            'comments.csv', 'id,post,author,text,created\n'
+            '20,10,reader,отличный пост,2019-05-02T08:00:00\n'
+            '21,99,reader,мимо,\n')
+        follows = self.write(
+            'follows.csv', 'user,author\nreader,writer\nreader,writer\n'
+            'writer,writer\n')
+        # Not touched by the import, so not rebuilt
+        bystander = User.objects.create_user(username="bystander")
+        UserStats.objects.create(user=bystander, post_count=7)
+        err = io.StringIO()
+        for kind, path in [('posts', posts), ('comments', comments),
+                           ('follows', follows)]:
+            call_command('import_content',
+                         kind,
+                         path,
+                         stdout=io.StringIO(),
+                         stderr=err)
+        self.assertIn("row 3: unknown user 'nobody'", err.getvalue())
+        self.assertIn('row 4: invalid JSON', err.getvalue())
+        self.assertIn("row 5: missing 'id'", err.getvalue())
+        self.assertIn('comment 21: unknown post 99', err.getvalue())
+        self.assertIn("row 3: 'writer' cannot follow themselves",
+                      err.getvalue())
+        self.assertIn(
+            f'follow {self.reader.id} -> {self.author.id}: already exists',
+            err.getvalue())
+
+        post = Post.objects.get(pk=10)
+        self.assertEqual(post.group, self.group)
+        self.assertEqual(post.pub_date.year, 2019)
+        self.assertEqual(post.comments.get().created.day, 2)
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Follow.objects.count(), 1)
+        # Derived data is rebuilt after each import
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(self.reader.timeline.count(), 2)
+        self.assertEqual(self.author.stats.post_count, 2)
+        self.assertEqual(
+            SearchPosting.objects.filter(term='отличный').get().post, post)
+        self.assertEqual(UserStats.objects.get(user=bystander).post_count, 7)
+
+    def test_existing_ids_are_rejected(self):
+        existing = Post.objects.create(id=10, text="local", author=self.author)
+        path = self.write(
+            'posts.jsonl', '\n'.join(
+                json.dumps({
+                    'id': post_id,
+                    'author': 'writer',
+                    'text': 'импорт',
+                    'pub_date': '2019-05-01T12:00:00'
+                }) for post_id in (10, 11, 11)))
+        out = io.StringIO()
+        err = io.StringIO()
+        call_command('import_content',
+                     'posts',
+                     path,
+                     stdout=out,
+                     stderr=err)
+        self.assertIn('Imported 1 posts, rejected 2', out.getvalue())
+        self.assertIn('post 10: id already exists', err.getvalue())
+        self.assertIn('post 11: id already exists', err.getvalue())
+        local = Post.objects.get(pk=10)
+        self.assertEqual((local.text, local.pub_date),
+                         (existing.text, existing.pub_date))
+        self.assertEqual(Post.objects.get(pk=11).pub_date.year, 2019)
+
+    def test_dates_are_kept_without_changing_the_field(self):
+        path = self.write(
+            'posts.jsonl',
+            json.dumps({
+                'id': 10,
+                'author': 'writer',
+                'text': 'старый',
+                'pub_date': '2019-05-01T12:00:00'
+            }))
+        field = Post._meta.get_field('pub_date')
+        flags = []
+
+        def derive(importer, batch):
+            # Posts saved meanwhile still get the current time
+            flags.append(field.auto_now_add)
+            return set()
+
+        with mock.patch(
+                'posts.management.commands.import_content.PostImporter.derive',
+                derive):
+            call_command('import_content', 'posts', path, stdout=io.StringIO())
+        self.assertEqual(flags, [True])
+        self.assertEqual(Post.objects.get().pub_date.year, 2019)
+
+    def test_resume_after_failure(self):
+        rows = [{
+            'id': i + 1,
+            'author': 'writer',
+            'text': f'пост {i}'
+        } for i in range(5)]
+        path = self.write('posts.jsonl',
+                          '\n'.join(json.dumps(row) for row in rows))
+        built = [
+            Post(id=row['id'],
+                 text=row['text'],
+                 author=self.author,
+                 pub_date=timezone.now()) for row in rows[:3]
+        ]
+        # The fourth row fails after the first chunk of two was committed
+        build = mock.Mock(side_effect=built + [RuntimeError('lost')])
+        with mock.patch(
+                'posts.management.commands.import_content.PostImporter.build',
+                build):
+            with self.assertRaises(RuntimeError):
+                call_command('import_content',
+                             'posts',
+                             path,
+                             '--batch-size=2',
+                             '--no-rebuild',
+                             stdout=io.StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+
+        out = io.StringIO()
+        call_command('import_content',
+                     'posts',
+                     path,
+                     '--batch-size=2',
+                     stdout=out)
+        self.assertIn('Resuming after row 2', out.getvalue())
+        self.assertEqual(
+            sorted(Post.objects.values_list('text', flat=True)),
+            [row['text'] for row in rows])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+        # The author of the chunk committed before the crash is rebuilt too
+        self.assertEqual(UserStats.objects.get(user=self.author).post_count,
+                         5)
+
+        # Rows already imported are skipped, not duplicated
+        call_command('import_content',
+                     'posts',
+                     path,
+                     '--restart',
+                     stdout=io.StringIO())
+        self.assertEqual(Post.objects.count(), 5)
+
+
+class TestServerTiming(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(username="writer")
+        Post.objects.create(text="post", author=author)
+        self.client = Client()
+
+    def timings(self, response):
+        return dict(
+            metric.split(';', 1)
+            for metric in response['Server-Timing'].split(', '))
+
+    def test_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            timings = self.timings(self.client.get(reverse('index')))
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+        self.assertTrue(timings['tpl'].startswith('dur='))
+        self.assertNotIn('misses=0', timings['cache'])
+
+        timings = self.timings(self.client.get(reverse('index')))
+        self.assertIn('misses=0"', timings['cache'])
+
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('yatube.performance', 'WARNING') as logs:
+            with override_settings(SLOW_REQUEST_THRESHOLD=0):
+                self.client.get(reverse('index'))
+        self.assertIn('path=/ status=200', logs.output[0])
+        self.assertIn('db_queries=', logs.output[0])
+
+    @override_settings(SERVER_TIMING_HEADER=False,
+                       SLOW_REQUEST_THRESHOLD=None)
+    def test_disabled(self):
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_staff_always_get_the_header(self):
+        staff = User.objects.create_user(username="staff", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('index'))
+        self.assertTrue(response.has_header('Server-Timing'))
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        collector = mock.patch.object(metrics, '_collector',
+                                      metrics.Collector())
+        collector.start()
+        self.addCleanup(collector.stop)
+        self.author = User.objects.create_user(username="writer")
+        Post.objects.create(text="post", author=self.author)
+        self.staff = User.objects.create_user(username="staff",
+                                              is_staff=True)
+        self.client = Client()
+
+    def scrape(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+        self.client.logout()
+        return response.content.decode().splitlines()
+
+    def test_histograms_per_route(self):
+        for _ in range(3):
+            self.client.get(reverse('index'))
+        self.client.get(reverse('profile', args=[self.author.username]))
+
+        lines = self.scrape()
+        self.assertIn('yatube_request_duration_seconds_count'
+                      '{route="index"} 3', lines)
+        self.assertIn('yatube_request_duration_seconds_bucket'
+                      '{route="index",le="+Inf"} 3', lines)
+        self.assertIn('yatube_request_queries_count{route="profile"} 1',
+                      lines)
+        self.assertIn('# TYPE yatube_response_size_bytes histogram', lines)
+
+    def test_thumbnail_counters(self):
+        Post.objects.create(text="picture",
+                            author=self.author,
+                            image='posts/picture.png')
+        with mock.patch('os.getpid', return_value=os.getppid()):
+            other = metrics.Collector()
+            other.increment('thumbnail_hits_total', 4)
+            other.flush()
+        with mock.patch('posts.thumbnails._submit'):
+            self.client.get(reverse('index'))
+
+        lines = self.scrape()
+        self.assertIn('# TYPE yatube_thumbnail_hits_total counter', lines)
+        self.assertIn('yatube_thumbnail_hits_total 4', lines)
+        self.assertIn('yatube_thumbnail_misses_total 1', lines)
+
+    def test_namespaced_routes_are_kept_apart(self):
+        self.client.get(reverse('index'))
+        post = Post.objects.get()
+        self.client.get(reverse('post', args=['writer', post.id]))
+        self.client.get(reverse('api:post', args=[post.id]))
+        self.client.force_login(self.staff)
+        self.client.get(reverse('admin:index'))
+
+        lines = self.scrape()
+        for route in ('index', 'post', 'api:post', 'admin:index'):
+            self.assertIn('yatube_request_queries_count'
+                          f'{{route="{route}"}} 1', lines)
+
+    def test_workers_are_merged(self):
+        # Another worker process, one that is running
+        with mock.patch('os.getpid', return_value=os.getppid()):
+            metrics.Collector().observe('index', 0.2, 4, 1000)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        self.client.get(reverse('index'))
+        lines = self.scrape()
+        self.assertIn('yatube_request_duration_seconds_count'
+                      '{route="index"} 2', lines)
+        self.assertIn('yatube_request_queries_bucket'
+                      '{route="index",le="+Inf"} 2', lines)
+
+    def test_files_of_exited_and_idle_workers_are_removed(self):
+        with mock.patch('os.getpid', return_value=os.getppid()):
+            idle = metrics.Collector()
+            idle.observe('index', 0.2, 4, 1000)
+        with mock.patch('os.getpid', return_value=2**22 + 1):
+            exited = metrics.Collector()
+            exited.observe('index', 0.2, 4, 1000)
+        old = time.time() - 2 * 24 * 60 * 60
+        os.utime(idle._path(), (old, old))
+
+        with mock.patch.object(metrics, '_alive',
+                               lambda pid: pid != exited._pid):
+            lines = self.scrape()
+        self.assertNotIn('{route="index"}', '\n'.join(lines))
+        # Only this worker's own file is left
+        self.assertEqual(os.listdir(self.directory),
+                         [os.path.basename(metrics._collector._path())])
+
+    def test_routes_do_not_hide_profiles(self):
+        for username in ('metrics', 'search'):
+            User.objects.create_user(username=username)
+            response = self.client.get(reverse('profile', args=[username]))
+            self.assertEqual(response.context['profile'].username, username)
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.reader = User.objects.create_user(username="reader")
+        self.group = Group.objects.create(title='Cond', slug='cond')
+        self.post = Post.objects.create(text="post",
+                                        author=self.author,
+                                        group=self.group)
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.urls = [
+            reverse('index'),
+            reverse('group_posts', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+            reverse('post', args=[self.author.username, self.post.id]),
+        ]
+
+    def revalidate(self, url, client=None):
+        client = client or self.client
+        etag = client.get(url)['ETag']
+        return client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def assertNotModified(self, url, client=None):
+        response = self.revalidate(url, client)
+        self.assertEqual(response.status_code, 304, url)
+        self.assertEqual(response.templates, [])
+
+    def test_unchanged_pages_are_not_rendered(self):
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            # Session and user only
+            with self.assertNumQueries(2):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.templates, [])
+
+    def test_changes_invalidate(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Comment.objects.create(post=self.post, author=self.reader, text="hi")
+        for url in self.urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_follow_changes_profile_cards(self):
+        profile, post = self.urls[2:]
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        self.client.get(reverse('profile_follow', args=[self.author.username]))
+        for url in [profile, post]:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200, url)
+        self.assertNotModified(profile)
+        response = self.client.get(self.urls[0],
+                                   HTTP_IF_NONE_MATCH=etags[self.urls[0]])
+        self.assertEqual(response.status_code, 304)
+
+    def test_follow_bumps_versions_without_loading_users(self):
+        follow = Follow(user_id=self.reader.id, author_id=self.author.id)
+        with self.assertNumQueries(0):
+            signals.refresh_profile_cards(Follow, follow)
+
+    def test_renamed_and_reused_names(self):
+        self.author.username = 'renamed'
+        self.author.save()
+        url = reverse('profile', args=['renamed'])
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        newcomer = User.objects.create_user(username="writer")
+        url = reverse('profile', args=['writer'])
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=self.reader, author=newcomer)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_depend_on_viewer(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        other = Client()
+        other.force_login(self.author)
+        response = other.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(
+            self.client.get(url + '?page=2',
+                            HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_last_modified_for_anonymous(self):
+        anonymous = Client()
+        for url in self.urls:
+            last_modified = anonymous.get(url)['Last-Modified']
+            response = anonymous.get(url,
+                                     HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertNotModified(url, anonymous)
+
+
+class TestApi(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.reader = User.objects.create_user(username="reader")
+        self.group = Group.objects.create(title='Api', slug='api')
+        self.posts = [
+            Post.objects.create(text=f"post {i}",
+                                author=self.author,
+                                group=self.group if i % 2 else None)
+            for i in range(5)
+        ]
+        self.client = Client()
+
+    def get(self, url, status=200, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return response.json()
+
+    def test_sparse_fields(self):
+        data = self.get(reverse('api:posts'), fields='id,author')
+        self.assertEqual(data['results'][0], {
+            'id': self.posts[-1].id,
+            'author': 'writer'
+        })
+        data = self.get(reverse('api:posts'), status=400, fields='id,secret')
+        self.assertIn('secret', data['detail'])
+
+    def test_cursor_pagination(self):
+        url = reverse('api:posts')
+        seen = []
+        data = self.get(url, fields='id', limit=2)
+        self.assertIsNone(data['previous'])
+        while True:
+            seen += [row['id'] for row in data['results']]
+            if data['next'] is None:
+                break
+            data = self.client.get(data['next']).json()
+        self.assertEqual(seen, [post.id for post in reversed(self.posts)])
+        back = self.client.get(data['previous']).json()
+        self.assertEqual([row['id'] for row in back['results']], seen[2:4])
+
+    def test_filtered_listings(self):
+        data = self.get(reverse('api:group_posts', args=['api']), fields='id')
+        self.assertEqual([row['id'] for row in data['results']],
+                         [self.posts[3].id, self.posts[1].id])
+        data = self.get(reverse('api:user_posts', args=['reader']))
+        self.assertEqual(data['results'], [])
+        self.get(reverse('api:group_posts', args=['nope']), status=404)
+
+    def test_feed(self):
+        self.get(reverse('api:feed'), status=403)
+        self.client.force_login(self.reader)
+        Follow.objects.create(user=self.reader, author=self.author)
+        data = self.get(reverse('api:feed'), fields='id', limit=3)
+        self.assertEqual([row['id'] for row in data['results']],
+                         [post.id for post in self.posts[:1:-1]])
+
+    def test_feed_checks_authentication_before_etag(self):
+        self.client.force_login(self.reader)
+        etag = self.client.get(reverse('api:feed'))['ETag']
+        self.client.logout()
+        response = self.client.get(reverse('api:feed'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('api:feed'),
+                                   HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 403)
+
+    def test_post_detail(self):
+        post = self.posts[0]
+        Comment.objects.create(post=post, author=self.reader, text="hi")
+        data = self.get(reverse('api:post', args=[post.id]),
+                        fields='text,comment_count')
+        self.assertEqual(data['text'], 'post 0')
+        self.assertEqual(data['comment_count'], 1)
+        self.assertEqual(data['comments'][0]['author'], 'reader')
+        self.assertIsNone(data['comments_next'])
+        self.get(reverse('api:post', args=[0]), status=404)
+
+    def test_post_comments_are_paged(self):
+        post = self.posts[0]
+        for i in range(3):
+            Comment.objects.create(post=post,
+                                   author=self.reader,
+                                   text=f"comment {i}")
+        data = self.get(reverse('api:post', args=[post.id]), limit=2)
+        self.assertEqual([row['text'] for row in data['comments']],
+                         ['comment 2', 'comment 1'])
+        data = self.client.get(data['comments_next']).json()
+        self.assertEqual([row['text'] for row in data['comments']],
+                         ['comment 0'])
+        self.assertIsNone(data['comments_next'])
+
+    def test_invalid_cursor(self):
+        for url in [
+                reverse('api:posts'),
+                reverse('api:user_posts', args=['writer']),
+                reverse('api:post', args=[self.posts[0].id])
+        ]:
+            for cursor in ['garbage', *WRONG_TYPED_CURSORS]:
+                for name in ('after', 'before'):
+                    with self.subTest(url=url, cursor=cursor, name=name):
+                        data = self.get(url, status=400, **{name: cursor})
+                        self.assertEqual(data['detail'], 'Invalid cursor')
+
+    def test_profile(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        url = reverse('api:profile', args=['writer'])
+        data = self.get(url)
+        self.assertEqual(data['post_count'], 5)
+        self.assertEqual(data['follower_count'], 1)
+        self.assertNotIn('following', data)
+        self.client.force_login(self.reader)
+        self.assertTrue(self.get(url)['following'])
+
+    def test_revalidation(self):
+        url = reverse('api:posts') + '?fields=id'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(text="new", author=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_read_only(self):
+        response = self.client.post(reverse('api:posts'))
+        self.assertEqual(response.status_code, 405)
+
+
+class TestFollowGraphCommit(TransactionTestCase):
+    def test_ids_loaded_before_the_commit_are_not_kept(self):
+        cache.clear()
+        author = User.objects.create_user(username="writer")
+        reader = User.objects.create_user(username="reader")
+        with transaction.atomic():
+            Follow.objects.create(user=reader, author=author)
+            # Another request reading the rows as they were before
+            with mock.patch.object(followgraph, '_load',
+                                   return_value=array('q')):
+                followgraph.following_ids(reader.id)
+        self.assertEqual(list(followgraph.following_ids(reader.id)),
+                         [author.id])
+
+
+class TestFollowGraph(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.other = User.objects.create_user(username="other")
+        self.reader = User.objects.create_user(username="reader")
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_loads_sorted_ids(self):
+        Follow.objects.create(user=self.reader, author=self.other)
+        Follow.objects.create(user=self.reader, author=self.author)
+        with self.assertNumQueries(1):
+            ids = followgraph.following_ids(self.reader.id)
+        self.assertEqual(list(ids), sorted([self.author.id, self.other.id]))
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                followgraph.is_following(self.reader, self.author))
+            self.assertFalse(
+                followgraph.is_following(self.reader, self.reader))
+
+    def test_follow_views_outdate_the_cached_ids(self):
+        followgraph.following_ids(self.reader.id)
+        self.client.get(reverse('profile_follow', args=['writer']))
+        self.client.get(reverse('profile_follow', args=['other']))
+        with self.assertNumQueries(1):
+            self.assertEqual(list(followgraph.following_ids(self.reader.id)),
+                             sorted([self.author.id, self.other.id]))
+        self.client.get(reverse('profile_unfollow', args=['writer']))
+        with self.assertNumQueries(1):
+            self.assertFalse(
+                followgraph.is_following(self.reader, self.author))
+            self.assertTrue(followgraph.is_following(self.reader, self.other))
+
+    def test_profile_button(self):
+        url = reverse('profile', args=['writer'])
+        self.assertFalse(self.client.get(url).context['following'])
+        self.client.get(reverse('profile_follow', args=['writer']))
+        self.assertTrue(self.client.get(url).context['following'])
+        self.assertFalse(Client().get(url).context['following'])
+
+    @override_settings(FEED_FROM_FOLLOW_GRAPH=True)
+    def test_feed_from_graph(self):
+        posts = [
+            Post.objects.create(text=f"post {i}", author=author)
+            for i, author in enumerate([self.author, self.other] * 2)
+        ]
+        self.client.get(reverse('profile_follow', args=['writer']))
+        # Not in the materialized feed
+        TimelineEntry.objects.all().delete()
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']),
+                         [posts[2], posts[0]])
+        self.client.get(reverse('profile_unfollow', args=['writer']))
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(len(response.context['page']), 0)
+
+    @override_settings(FEED_FROM_FOLLOW_GRAPH=True)
+    def test_feed_of_more_authors_than_query_parameters(self):
+        User.objects.bulk_create(
+            User(username=f"author{i}") for i in range(1000))
+        authors = User.objects.filter(username__startswith='author')
+        Follow.objects.bulk_create(
+            Follow(user=self.reader, author=author) for author in authors)
+        post = Post.objects.create(text="post", author=authors.last())
+        followgraph.forget([self.reader.id])
+        self.assertEqual(len(followgraph.following_ids(self.reader.id)),
+                         1000)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']), [post])
+        # Selected by a subquery rather than 1000 bound ids
+        feed = [q['sql'] for q in queries if 'FROM "posts_post"' in q['sql']]
+        self.assertIn('FROM "posts_follow"', feed[0])
+
+
+class TestCommentPages(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.post = Post.objects.create(text="viral", author=self.author)
+        readers = [
+            User.objects.create_user(username=f"reader{i}") for i in range(3)
+        ]
+        self.comments = [
+            Comment.objects.create(post=self.post,
+                                   author=readers[i % 3],
+                                   text=f"comment {i}") for i in range(45)
+        ]
+        self.client = Client()
+        self.url = reverse('post', args=[self.author.username, self.post.id])
+
+    def test_newest_comments_first(self):
+        # post, stats, comments with their authors and one older
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        comments = response.context['comments']
+        self.assertEqual(list(comments), self.comments[:-21:-1])
+        self.assertContains(response, 'comment 44')
+        self.assertNotContains(response, 'comment 24<')
+
+    def test_load_older_chunks(self):
+        url = self.client.get(self.url).context['older_comments_url']
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertTemplateUsed(response, 'comment_list.html')
+            self.assertTemplateNotUsed(response, 'base.html')
+            seen += response.context['comments']
+            url = response.context['older_comments_url']
+        self.assertEqual(seen, self.comments[-21::-1])
+
+    def test_no_link_without_older_comments(self):
+        Comment.objects.filter(pk__in=[c.pk for c in self.comments[:25]
+                                       ]).delete()
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['comments']), 20)
+        self.assertIsNone(response.context['older_comments_url'])
+
+    def test_invalid_cursor_loads_the_newest_chunk(self):
+        url = reverse('post_comments', args=['writer', self.post.id])
+        for cursor in ['garbage', *WRONG_TYPED_CURSORS]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(url, {'after': cursor})
+                self.assertEqual(list(response.context['comments']),
+                                 self.comments[:-21:-1])
+
+    def test_wrong_author_is_not_found(self):
+        url = reverse('post_comments', args=['nobody', self.post.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class TestImageUploads(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.directory.name,
+                                          THUMBNAIL_WORKERS=0,
+                                          IMAGE_UPLOAD_MAX_SIZE=400)
+        self.settings.enable()
+        self.author = User.objects.create_user(username="camera")
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def image_file(self, image, name, **save_options):
+        file_ = io.BytesIO()
+        image.save(file_, **save_options)
+        file_.name = name
+        file_.seek(0)
+        return file_
+
+    def upload(self, image, name, **save_options):
+        return self.client.post(reverse('new_post'), {
+            'text': name,
+            'image': self.image_file(image, name, **save_options)
+        })
+
+    def test_photo_is_rotated_downscaled_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90° clockwise
+        exif[0x010F] = 'Camera maker'
+        self.upload(Image.new('RGB', (1200, 800), 'red'),
+                    'photo.JPEG',
+                    format='JPEG',
+                    exif=exif.tobytes())
+        post = Post.objects.get(text='photo.JPEG')
+        self.assertEqual(post.image.name, 'posts/photo.jpg')
+        self.assertEqual((post.image_width, post.image_height), (267, 400))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (267, 400))
+            self.assertNotIn('exif', image.info)
+
+    def test_transparent_image_is_flattened(self):
+        self.upload(Image.new('RGBA', (50, 40), (0, 0, 0, 0)),
+                    'icon.png',
+                    format='PNG')
+        post = Post.objects.get(text='icon.png')
+        self.assertEqual((post.image_width, post.image_height), (50, 40))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.mode, 'RGB')
+            self.assertEqual(image.getpixel((0, 0)), (255, 255, 255))
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=10**6)
+    def test_too_many_pixels_are_rejected_before_decoding(self):
+        bomb = self.image_file(Image.new('1', (2000, 1000)),
+                               'bomb.png',
+                               format='PNG')
+        with mock.patch.object(Image.Image, 'load') as load:
+            response = self.client.post(reverse('new_post'), {
+                'text': 'bomb',
+                'image': bomb
+            })
+        load.assert_not_called()
+        self.assertFalse(Post.objects.exists())
+        self.assertIn('слишком большое',
+                      response.context['form'].errors['image'][0])
+
+    def test_clearing_the_image_forgets_its_size(self):
+        self.upload(Image.new('RGB', (30, 20)), 'small.png', format='PNG')
+        post = Post.objects.get()
+        self.client.post(
+            reverse('post_edit', args=[self.author.username, post.id]), {
+                'text': 'cleared',
+                'image-clear': 'on'
+            })
+        post.refresh_from_db()
+        self.assertFalse(post.image)
+        self.assertIsNone(post.image_width)
+
+
+class TestStaticFiles(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        source = os.path.join(self.directory.name, 'source')
+        os.makedirs(os.path.join(source, 'img'))
+        with open(os.path.join(source, 'app.css'), 'w') as css:
+            css.write('body { background: url("img/dot.png"); }\n' * 50)
+        Image.new('RGB', (4, 4)).save(os.path.join(source, 'img', 'dot.png'))
+        self.root = os.path.join(self.directory.name, 'root')
+        self.settings = override_settings(STATIC_ROOT=self.root,
+                                          STATICFILES_DIRS=[source],
+                                          STATICFILES_FINDERS=[
+                                              'django.contrib.staticfiles.'
+                                              'finders.FileSystemFinder'
+                                          ])
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def collect(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_uncollected_names_are_served_plain(self):
+        self.assertEqual(static('app.css'), '/static/app.css')
+
+    def test_names_missing_from_the_manifest_raise(self):
+        self.collect()
+        with self.assertRaisesMessage(ValueError, 'manifest entry'):
+            static('missing.css')
+
+    def test_collect_writes_hashed_and_compressed_copies(self):
+        self.collect()
+        url = static('app.css')
+        self.assertRegex(url, r'^/static/app\.[0-9a-f]{12}\.css$')
+        path = os.path.join(self.root, url[len('/static/'):])
+        with open(path, 'rb') as plain, gzip.open(path + '.gz') as packed:
+            content = plain.read()
+            self.assertEqual(packed.read(), content)
+        # References inside CSS point at hashed names too
+        self.assertRegex(content.decode(), r'img/dot\.[0-9a-f]{12}\.png')
+        self.assertFalse(
+            [name for name in os.listdir(os.path.join(self.root, 'img'))
+             if name.endswith('.gz')])
+
+    def test_serving(self):
+        self.collect()
+        url = static('app.css')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        with open(os.path.join(self.root, url[len('/static/'):]),
+                  'rb') as plain:
+            self.assertEqual(
+                gzip.decompress(b''.join(response.streaming_content)),
+                plain.read())
+
+        for encoding in ['', 'deflate', 'gzip;q=0']:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = self.client.get('/static/app.css')
+        self.assertEqual(response['Cache-Control'],
+                         'public, max-age=0, must-revalidate')
+        # Called directly: the 404 page needs assets this test did not
+        # collect
+        for missing in ['nope.css', '../manage.py']:
+            request = RequestFactory().get('/static/' + missing)
+            with self.assertRaises(Http404):
+                staticfiles.serve(request, missing)
+
+
+class TestStreamedPages(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer")
+        self.post = Post.objects.create(text="streamed post " * 100,
+                                        author=self.author)
+        Comment.objects.create(post=self.post,
+                               author=self.author,
+                               text="streamed comment")
+        self.client = Client()
+        self.client.force_login(self.author)
+        self.urls = [
+            reverse('profile', args=[self.author.username]),
+            reverse('post', args=[self.author.username, self.post.id]),
+        ]
+
+    def test_head_is_sent_before_the_posts(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertTrue(response.streaming)
+            chunks = [chunk.decode() for chunk in response.streaming_content]
+            self.assertIn('<nav', chunks[0])
+            self.assertNotIn('streamed post', chunks[0])
+            self.assertIn('streamed post', ''.join(chunks[1:]))
+            self.assertTrue(chunks[-1].rstrip().endswith('</html>'))
+            self.assertNotIn('<!-- streamed', ''.join(chunks))
+
+    def test_streamed_forms_get_a_csrf_cookie(self):
+        response = self.client.get(self.urls[1])
+        self.assertIn('csrftoken', response.cookies)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_gzip_is_flushed_per_chunk(self):
+        response = self.client.get(self.urls[1],
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = iter(response.streaming_content)
+        # Gzip header, then the page up to the first block
+        head = b''.join(decompressor.decompress(next(chunks))
+                        for _ in range(2)).decode()
+        self.assertIn('<nav', head)
+        rest = b''.join(decompressor.decompress(chunk) for chunk in chunks)
+        self.assertIn('streamed comment', rest.decode())
+
+    def test_compression_rules(self):
+        gzip_client = Client(HTTP_ACCEPT_ENCODING='gzip')
+        # Plain responses below the threshold stay as they are
+        response = gzip_client.get(reverse('api:posts'), {'fields': 'id'})
+        self.assertFalse(response.has_header('Content-Encoding'))
+        response = gzip_client.get(reverse('api:posts'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)),
+                         self.client.get(reverse('api:posts')).json())
+        # gzip;q=0 refuses gzip
+        response = self.client.get(reverse('api:posts'),
+                                   HTTP_ACCEPT_ENCODING='gzip;q=0, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    @override_settings(GZIP_CONTENT_TYPES=('application/json', ))
+    def test_content_type_allowlist(self):
+        response = self.client.get(self.urls[0], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], PRIMARY_PIN_SECONDS=5)
+class TestDatabaseRouting(SimpleTestCase):
+    def setUp(self):
+        # The replicas had time to catch up with the last change
+        cache.set(CHANGED_KEY, time.time() - 60, None)
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request, *operations):
+        """Aliases picked for 'read'/'write' operations done by a view, and
+        the response."""
+        aliases = []
+
+        def view(request):
+            for operation in operations:
+                route = getattr(self.router, f'db_for_{operation}')
+                aliases.append(route(Post))
+            return HttpResponse()
+
+        return aliases, ReplicaPinningMiddleware(view)(request)
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        aliases, response = self.route(self.factory.get('/'), 'read',
+                                       'write', 'read')
+        self.assertEqual(aliases, ['replica', 'default', 'default'])
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+
+        aliases, response = self.route(self.factory.get('/'), 'read')
+        self.assertEqual(aliases, ['replica'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_pinned_requests_read_from_primary(self):
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.route(request, 'read')[0], ['default'])
+        self.assertEqual(
+            self.route(self.factory.post('/'), 'read')[0], ['default'])
+
+    def test_streamed_bodies_keep_the_routing(self):
+        aliases = []
+
+        def view(request):
+            def body():
+                aliases.append(self.router.db_for_read(Post))
+                yield ''
+
+            if request.method == 'POST':
+                self.router.db_for_write(Post)
+            return StreamingHttpResponse(body())
+
+        for request in [self.factory.get('/'), self.factory.post('/')]:
+            response = ReplicaPinningMiddleware(view)(request)
+            b''.join(response.streaming_content)
+        self.assertEqual(aliases, ['replica', 'default'])
+
+    def test_recent_changes_keep_reading_from_replicas(self):
+        cache.set(CHANGED_KEY, time.time(), None)
+        cacheable = []
+
+        def view(request):
+            cacheable.append(may_cache())
+            return HttpResponse()
+
+        for request in [self.factory.get('/'), self.factory.post('/')]:
+            ReplicaPinningMiddleware(view)(request)
+        self.assertEqual(cacheable, [False, True])
+        self.assertEqual(self.route(self.factory.get('/'), 'read')[0],
+                         ['replica'])
+        self.assertTrue(may_cache())
+
+    def test_primary_only(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(
+                self.route(self.factory.get('/'), 'read')[0], ['default'])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class TestReplicaDatabase(TransactionTestCase):
+    """A second SQLite file stands in for a replica that lags behind."""
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(self.directory.name, 'replica.sqlite3'),
+        }
+        call_command('migrate', database='replica', verbosity=0)
+        author = User.objects.create_user(username="writer",
+                                          password="secret")
+        Post.objects.create(text="only on the primary", author=author)
+        self.settled = override_settings(PRIMARY_PIN_SECONDS=0)
+
+    def tearDown(self):
+        connections['replica'].close()
+        del connections.databases['replica']
+        del connections._connections.replica
+        self.directory.cleanup()
+
+    def test_writers_read_their_writes(self):
+        self.settled.enable()
+        self.addCleanup(self.settled.disable)
+        client = Client()
+        self.assertNotContains(client.get(reverse('index')),
+                               'only on the primary')
+
+        response = client.post(reverse('login'), {
+            'username': 'writer',
+            'password': 'secret'
+        })
+        self.assertIn(PIN_COOKIE, response.cookies)
+        response = client.get(reverse('index'))
+        self.assertContains(response, 'only on the primary')
+        self.assertEqual(response.context['user'].username, 'writer')
+
+        # Once the pin expires the replica knows neither post nor session
+        del client.cookies[PIN_COOKIE]
+        response = client.get(reverse('index'))
+        self.assertNotContains(response, 'only on the primary')
+        self.assertFalse(response.context['user'].is_authenticated)
+
+    def test_lagging_replica_does_not_fill_new_listings(self):
+        # Right after the post the generation has moved on, the replica
+        # has not: nothing read from it is cached or validated under it
+        client = Client()
+        response = client.get(reverse('index'))
+        self.assertNotContains(response, 'only on the primary')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # The replica catches up
+        post = Post.objects.get()
+        User.objects.using('replica').bulk_create(
+            [User(id=post.author_id, username='writer')])
+        Post.objects.using('replica').bulk_create([
+            Post(id=post.id,
+                 text=post.text,
+                 author_id=post.author_id,
+                 pub_date=post.pub_date)
+        ])
+        response = client.get(reverse('index'))
+        self.assertContains(response, 'only on the primary')
 
-        self.assertNotContains(cached_response, post_text)
+        with self.settled:
+            etag = client.get(reverse('index'))['ETag']
+            response = client.get(reverse('index'),
+                                  HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
@@ -0,0 +1,271 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import settings as sorl_settings
+from yatube import metrics
+
+from .caching import bump_generation
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Every geometry the templates ask for, pre-generated after upload
+GEOMETRIES = {
+    'card': ('960x339', {
+        'crop': 'center',
+        'upscale': True
+    }),
+}
+
+# Card widths listed in srcset. Widths above the source image's are left
+# out, except the smallest
+VARIANT_WIDTHS = (320, 480, 640, 960)
+# The inline preview is stretched over the card until the image loads
+PREVIEW_SIZE = (28, 10)
+
+# Generated thumbnails by geometry name and source image name, recorded by
+# `generate`, so a page's thumbnails are found with one cache get_many
+THUMBNAIL_KEY = 'posts:thumbnail:{}:{}'
+
+_executor = None
+_executor_lock = threading.Lock()
+# Images queued or being generated, and when generating others last failed
+_pending = set()
+_failed = {}
+_pending_lock = threading.Lock()
+
+
+class Placeholder:
+    """Stands in for a thumbnail that is still being generated."""
+
+    def __init__(self, geometry):
+        width, height = geometry.split('x')
+        self.width, self.height = int(width), int(height)
+        svg = (f"<svg xmlns='http://www.w3.org/2000/svg' width='{width}' "
+               f"height='{height}'><rect width='100%' height='100%' "
+               "fill='#e9ecef'/></svg>")
+        self.url = 'data:image/svg+xml,' + quote(svg)
+
+
+class Responsive:
+    """Card image with width variants, made from what `generate` stored on
+    the post, so it needs no cache lookup."""
+
+    def __init__(self, variants, preview, original):
+        storage = default.storage
+        self.srcset = ', '.join(f'{storage.url(name)} {width}w'
+                                for name, width, _ in variants)
+        if variants:
+            name, self.width, self.height = variants[-1]
+            self.url = storage.url(name)
+        else:
+            # Stored without variants, e.g. by an import
+            self.url, self.width, self.height = original.url, None, None
+        self.preview = preview
+
+
+class StoredThumbnail:
+    """Thumbnail as `generate` recorded it."""
+
+    def __init__(self, name, width, height):
+        self.url = default.storage.url(name)
+        self.width, self.height = width, height
+
+
+def _thumbnail_key(image_name, name):
+    digest = hashlib.md5(image_name.encode()).hexdigest()
+    return THUMBNAIL_KEY.format(name, digest)
+
+
+def _remember(image_name, name, thumbnail):
+    cache.set(_thumbnail_key(image_name, name),
+              (thumbnail.name, thumbnail.width, thumbnail.height),
+              sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+
+
+def cached_thumbnails(images, name='card'):
+    """Generated thumbnails of `images` as `{image: thumbnail}`; images
+    without one are left out. Never touches storage."""
+    keys = {_thumbnail_key(image, name): image for image in images}
+    found = cache.get_many(list(keys))
+    return {
+        keys[key]: StoredThumbnail(*value)
+        for key, value in found.items()
+    }
+
+
+def cached_thumbnail(image, name='card'):
+    """Generated thumbnail of `image`, or None. Never touches storage."""
+    return cached_thumbnails([image], name).get(image)
+
+
+def _preview(image):
+    image.draft('RGB', (PREVIEW_SIZE[0] * 2, PREVIEW_SIZE[1] * 2))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    preview = ImageOps.fit(image, PREVIEW_SIZE, Image.BICUBIC)
+    output = BytesIO()
+    preview.save(output, 'JPEG', quality=40)
+    return ('data:image/jpeg;base64,' +
+            base64.b64encode(output.getvalue()).decode())
+
+
+def image_variants(image_name):
+    """Width variants of the card of `image_name` as JSON
+    `[[name, width, height], ...]`, and a tiny preview as a data URI."""
+    with default.storage.open(image_name) as file_, \
+            Image.open(file_) as image:
+        # Before the preview, which decodes a reduced draft
+        width = image.size[0]
+        preview = _preview(image)
+    geometry, options = GEOMETRIES['card']
+    card_width, card_height = map(int, geometry.split('x'))
+    widths = [w for w in VARIANT_WIDTHS if w <= width] or VARIANT_WIDTHS[:1]
+    variants = []
+    for variant_width in widths:
+        variant_height = round(variant_width * card_height / card_width)
+        thumbnail = get_thumbnail(image_name,
+                                  f'{variant_width}x{variant_height}',
+                                  **options)
+        variants.append([thumbnail.name, thumbnail.width, thumbnail.height])
+    return json.dumps(variants), preview
+
+
+def generate(post_id, image_name):
+    """Generates the thumbnails and variants of `image_name`; returns
+    whether it succeeded."""
+    if not default.storage.exists(image_name):
+        logger.warning('Image %s of post %s is missing', image_name, post_id)
+        return False
+    try:
+        for name, (geometry, options) in GEOMETRIES.items():
+            _remember(image_name, name,
+                      get_thumbnail(image_name, geometry, **options))
+        variants, preview = image_variants(image_name)
+    except Exception:
+        logger.exception('Could not generate thumbnails of %s', image_name)
+        return False
+    # Cached cards of the post still show the placeholder
+    Post.objects.filter(pk=post_id, image=image_name).update(
+        image_variants=variants,
+        image_preview=preview,
+        version=F('version') + 1)
+    bump_generation()
+    return True
+
+
+def _claim(image_name):
+    """Marks `image_name` as queued, unless it already is or it failed less
+    than `THUMBNAIL_RETRY_DELAY` seconds ago."""
+    with _pending_lock:
+        if image_name in _pending:
+            return False
+        failed_at = _failed.get(image_name)
+        if (failed_at is not None and time.monotonic() - failed_at <
+                settings.THUMBNAIL_RETRY_DELAY):
+            return False
+        _failed.pop(image_name, None)
+        _pending.add(image_name)
+        return True
+
+
+def _run(post_id, image_name):
+    succeeded = False
+    try:
+        succeeded = generate(post_id, image_name)
+    finally:
+        with _pending_lock:
+            _pending.discard(image_name)
+            if not succeeded:
+                # Renders do not queue it again until the delay is over
+                _failed[image_name] = time.monotonic()
+
+
+def _run_in_worker(post_id, image_name):
+    try:
+        _run(post_id, image_name)
+    finally:
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+    return _executor
+
+
+def _submit(post_id, image_name):
+    if not _claim(image_name):
+        return
+    if not settings.THUMBNAIL_WORKERS:
+        _run(post_id, image_name)
+        return
+    _get_executor().submit(_run_in_worker, post_id, image_name)
+
+
+def schedule(post):
+    """Queues thumbnail generation for `post` once its row is committed."""
+    if post.image:
+        transaction.on_commit(lambda: _submit(post.pk, post.image.name))
+
+
+def resolve_thumbnails(posts, name='card'):
+    """Thumbnails of every post with an image, as `{post.pk: thumbnail}`.
+
+    Posts with stored variants need no lookup, the rest of a page is
+    resolved with one cache `get_many`. Posts whose thumbnail is not
+    generated yet get a placeholder and a job.
+    """
+    resolved = {}
+    posts = [post for post in posts if post.image]
+    for post in posts:
+        if post.image_variants and name == 'card':
+            resolved[post.pk] = Responsive(json.loads(post.image_variants),
+                                           post.image_preview, post.image)
+    found = cached_thumbnails(
+        [post.image.name for post in posts if post.pk not in resolved], name)
+    misses = 0
+    for post in posts:
+        if post.pk in resolved:
+            continue
+        thumbnail = found.get(post.image.name)
+        if thumbnail is None:
+            # Lost or never generated (e.g. uploaded before pre-generation)
+            _submit(post.pk, post.image.name)
+            thumbnail = Placeholder(GEOMETRIES[name][0])
+            misses += 1
+        resolved[post.pk] = thumbnail
+    if posts:
+        # Summed over the workers at /-/metrics/
+        metrics.increment('thumbnail_hits_total', len(posts) - misses)
+        metrics.increment('thumbnail_misses_total', misses)
+    return resolved
+
+
+def resolver_stats():
+    """Resolver hits and misses of this process."""
+    counters = metrics.counters()
+    return {
+        'hits': counters.get('thumbnail_hits_total', 0),
+        'misses': counters.get('thumbnail_misses_total', 0),
+    }
+
+
+def thumbnail_or_placeholder(post, name='card'):
+    return resolve_thumbnails([post], name)[post.pk]
@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from . import followgraph
+from .models import Follow, Post, TimelineEntry
+
+BATCH_SIZE = 500
+FEED_ORDERING = ('-feed_date', '-feed_post')
+# Followed authors passed to the feed query as a list of ids. Beyond that
+# a subquery on `Follow` selects them, since every id is a bound
+# parameter and SQLite takes at most 999 of them per query
+MAX_GRAPH_AUTHORS = 500
+
+# Entries of every follower of an author past their newest
+# `TIMELINE_LENGTH`: those not newer than the entry right after them, found
+# per follower by an index seek, so only the inboxes over the limit are
+# touched. The derived table lets MySQL delete from the table it reads
+TRIM_FOLLOWERS_SQL = '''
+DELETE FROM {entries} WHERE id IN (
+    SELECT id FROM (
+        SELECT entry.id
+        FROM (
+            SELECT follower.user_id,
+                (SELECT pub_date FROM {entries} newer
+                 WHERE newer.user_id = follower.user_id
+                 ORDER BY pub_date DESC, post_id DESC
+                 LIMIT 1 OFFSET %s) AS pub_date,
+                (SELECT post_id FROM {entries} newer
+                 WHERE newer.user_id = follower.user_id
+                 ORDER BY pub_date DESC, post_id DESC
+                 LIMIT 1 OFFSET %s) AS post_id
+            FROM {follows} follower
+            WHERE follower.author_id = %s
+        ) boundary
+        JOIN {entries} entry ON entry.user_id = boundary.user_id
+        WHERE entry.pub_date < boundary.pub_date
+            OR entry.pub_date = boundary.pub_date
+            AND entry.post_id <= boundary.post_id
+    ) trimmed
+)
+'''
+
+
+def _entries(user_ids, posts):
+    return [
+        TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for user_id in user_ids for post_id, pub_date in posts
+    ]
+
+
+def trim(user_id):
+    """Drops everything past the newest `TIMELINE_LENGTH` entries."""
+    boundary = TimelineEntry.objects.filter(user_id=user_id).values_list(
+        'pub_date', 'post_id')[settings.TIMELINE_LENGTH:
+                               settings.TIMELINE_LENGTH + 1]
+    boundary = list(boundary)
+    if not boundary:
+        return
+    pub_date, post_id = boundary[0]
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 pub_date__lt=pub_date).delete()
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 pub_date=pub_date,
+                                 post_id__lte=post_id).delete()
+
+
+def trim_followers(author_id):
+    """`trim` for every follower of `author_id`, in one statement."""
+    quote = connection.ops.quote_name
+    sql = TRIM_FOLLOWERS_SQL.format(
+        entries=quote(TimelineEntry._meta.db_table),
+        follows=quote(Follow._meta.db_table))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            settings.TIMELINE_LENGTH, settings.TIMELINE_LENGTH, author_id
+        ])
+
+
+def push_post(post):
+    follower_ids = list(
+        Follow.objects.filter(author_id=post.author_id).values_list(
+            'user_id', flat=True))
+    if not follower_ids:
+        return
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(_entries(
+            follower_ids, [(post.id, post.pub_date)]),
+                                          batch_size=BATCH_SIZE,
+                                          ignore_conflicts=True)
+        trim_followers(post.author_id)
+
+
+def backfill(user_id, author_id):
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'id', 'pub_date')[:settings.TIMELINE_LENGTH]
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(_entries([user_id], posts),
+                                          batch_size=BATCH_SIZE,
+                                          ignore_conflicts=True)
+        trim(user_id)
+
+
+def evict(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 post__author_id=author_id).delete()
+
+
+def rebuild(user_id):
+    following = Follow.objects.filter(user_id=user_id).values('author')
+    posts = Post.objects.filter(author__in=following).values_list(
+        'id', 'pub_date')[:settings.TIMELINE_LENGTH]
+    with transaction.atomic():
+        TimelineEntry.objects.filter(user_id=user_id).delete()
+        TimelineEntry.objects.bulk_create(_entries([user_id], posts),
+                                          batch_size=BATCH_SIZE)
+
+
+def feed(user):
+    """Posts from the user's inbox, newest first, ordered by
+    `FEED_ORDERING`.
+
+    With `settings.FEED_FROM_FOLLOW_GRAPH` the posts are instead selected
+    by the cached ids of the followed authors, which skips the inbox join
+    and is not limited to `TIMELINE_LENGTH` posts.
+    """
+    if settings.FEED_FROM_FOLLOW_GRAPH:
+        author_ids = followgraph.following_ids(user.pk)
+        if len(author_ids) <= MAX_GRAPH_AUTHORS:
+            authors = list(author_ids)
+        else:
+            authors = Follow.objects.filter(user=user).values('author')
+        posts = Post.objects.for_feed().filter(author_id__in=authors)
+        return posts.annotate(feed_date=F('pub_date'),
+                              feed_post=F('id')).order_by(*FEED_ORDERING)
+    posts = Post.objects.for_feed().filter(timeline_entries__user=user)
+    # Both from the inbox row: its (user, pub_date, post) index is walked
+    # in order instead of sorting the page
+    return posts.annotate(
+        feed_date=F('timeline_entries__pub_date'),
+        feed_post=F('timeline_entries__post')).order_by(*FEED_ORDERING)
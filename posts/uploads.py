@@ -0,0 +1,94 @@
+"""Normalization of uploaded post images.
+
+Phone photos arrive as multi-megabyte files that keep their rotation and
+camera data (location included) in EXIF. `normalize` turns an upload into
+an image that fits `IMAGE_UPLOAD_MAX_SIZE`, has the rotation applied, no
+metadata and one format, so thumbnails are made from the small file.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+SAVE_OPTIONS = {
+    'JPEG': {
+        'optimize': True,
+        'progressive': True
+    },
+    'WEBP': {
+        'method': 6
+    },
+    'PNG': {
+        'optimize': True
+    },
+}
+
+
+class NormalizedImage(ContentFile):
+    def __init__(self, content, name, width, height):
+        super().__init__(content, name=name)
+        self.width = width
+        self.height = height
+
+
+def _has_alpha(image):
+    return (image.mode in ('RGBA', 'LA')
+            or image.mode == 'P' and 'transparency' in image.info)
+
+
+def _convert(image, image_format):
+    if not _has_alpha(image):
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    if image_format != 'JPEG':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def normalize(upload):
+    """Re-encodes an uploaded image; raises ValidationError for images with
+    too many pixels before decoding them."""
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Файл не является изображением.',
+                              code='invalid_image') from None
+    width, height = image.size
+    limit = settings.IMAGE_UPLOAD_MAX_PIXELS
+    if width * height > limit:
+        raise ValidationError(
+            'Изображение %(width)s×%(height)s слишком большое, допустимо '
+            'не больше %(megapixels)s мегапикселей.',
+            code='too_many_pixels',
+            params={
+                'width': width,
+                'height': height,
+                'megapixels': limit // 10**6,
+            })
+
+    box = (settings.IMAGE_UPLOAD_MAX_SIZE, settings.IMAGE_UPLOAD_MAX_SIZE)
+    icc_profile = image.info.get('icc_profile')
+    # JPEGs are decoded at a reduced scale when that still covers the box
+    image.draft('RGB', box)
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(box, Image.LANCZOS)
+
+    image_format = settings.IMAGE_UPLOAD_FORMAT
+    image = _convert(image, image_format)
+    output = BytesIO()
+    # Saved without exif, so the camera metadata is dropped
+    image.save(output,
+               image_format,
+               quality=settings.IMAGE_UPLOAD_QUALITY,
+               icc_profile=icc_profile,
+               **SAVE_OPTIONS.get(image_format, {}))
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    return NormalizedImage(output.getvalue(),
+                           f'{stem}.{EXTENSIONS[image_format]}', *image.size)
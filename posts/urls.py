@@ -7,6 +7,8 @@ urlpatterns = [
     path("group/<slug:slug>/", views.group_posts, name="group_posts"),
     path("new/", views.new_post, name='new_post'),
     path("follow/", views.follow_index, name="follow_index"),
+    # Not "search/", which is the profile of a user named "search"
+    path("-/search/", views.search_posts, name="search"),
     path('<str:username>/', views.profile, name='profile'),
     path("<str:username>/follow/", views.profile_follow,
          name="profile_follow"),
@@ -14,6 +16,9 @@ urlpatterns = [
          views.profile_unfollow,
          name="profile_unfollow"),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
+    path('<str:username>/<int:post_id>/comments/',
+         views.post_comments,
+         name='post_comments'),
     path('<str:username>/<int:post_id>/edit/',
          views.post_edit,
          name='post_edit'),
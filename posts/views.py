@@ -1,30 +1,36 @@
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.shortcuts import render, get_object_or_404, redirect, reverse
+from django.views.decorators.http import condition
 
+from . import followgraph, search, stats, thumbnails, timeline
+from .conditional import author_etag, last_modified, listing_etag
 from .forms import CommentForm, PostForm
 from .models import Comment, Post, Group, User, Follow
+from .paginator import (PER_PAGE, decode_cursor, encode_cursor,
+                        keyset_filter, paginate)
+from .streaming import render_stream
 
+COMMENTS_PER_PAGE = 20
+COMMENT_ORDERING = ('-created', '-id')
 
-def index(request):
-    posts = Post.objects.all()
-    paginator = Paginator(posts, 10)
 
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+@condition(etag_func=listing_etag, last_modified_func=last_modified)
+def index(request):
+    posts = Post.objects.for_feed()
+    paginator, page = paginate(request, posts)
     return render(request, 'index.html', {
         'page': page,
         'paginator': paginator
     })
 
 
+@condition(etag_func=listing_etag, last_modified_func=last_modified)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = group.posts.for_feed()
+    paginator, page = paginate(request, posts)
     return render(request, "group.html", {
         "group": group,
         'page': page,
@@ -38,74 +44,98 @@ def new_post(request):
     if request.method == 'POST':
         if form.is_valid():
             if request.user.is_authenticated:
-                post = Post(**form.cleaned_data, author=request.user)
-                post.save()
+                post = form.save(commit=False)
+                post.author = request.user
+                with transaction.atomic():
+                    post.save()
+                    thumbnails.schedule(post)
                 return redirect('/')
             return redirect('/auth/login')
 
     return render(request, "new_post.html", {"form": form})
 
 
+@condition(etag_func=author_etag, last_modified_func=last_modified)
 def profile(request, username):
     requested_user = get_object_or_404(User, username=username)
-    posts = requested_user.posts.count()
-    all_posts = requested_user.posts.all()
-    paginator = Paginator(all_posts, 10)
-
-    is_following = request.user.is_authenticated and Follow.objects.filter(
-        author=requested_user, user=request.user).exists()
+    user_stats = stats.for_user(requested_user)
+    all_posts = requested_user.posts.for_feed()
+    paginator, page = paginate(request, all_posts)
 
-    follower_count = Follow.objects.filter(author=requested_user).count()
-    follows_count = Follow.objects.filter(user=requested_user).count()
+    is_following = followgraph.is_following(request.user, requested_user)
 
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(
+    return render_stream(
         request, 'profile.html', {
             'following': is_following,
-            'follower_count': follower_count,
-            'follows_count': follows_count,
+            'follower_count': user_stats.follower_count,
+            'follows_count': user_stats.follows_count,
             'profile': requested_user,
-            "post_count": posts,
+            "post_count": user_stats.post_count,
             'page': page,
             'paginator': paginator,
             'does_own_profile': request.user == requested_user,
         })
 
 
+@condition(etag_func=author_etag, last_modified_func=last_modified)
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post,
+    post = get_object_or_404(Post.objects.for_feed(),
                              id__exact=post_id,
                              author__username=username)
     author = post.author
-    post_count = author.posts.count()
+    user_stats = stats.for_user(author)
 
     comment_form = CommentForm()
 
-    is_following = request.user.is_authenticated and Follow.objects.filter(
-        author=author, user=request.user).exists()
-
-    follower_count = Follow.objects.filter(author=author).count()
-    follows_count = Follow.objects.filter(user=author).count()
-
-    comments = post.comments.all()
+    is_following = followgraph.is_following(request.user, author)
 
-    return render(
+    return render_stream(
         request,
         'post.html',
         {
             'profile': author,
-            "post_count": post_count,
+            "post_count": user_stats.post_count,
             'post': post,
-            'comments': comments,
+            **_comment_chunk(username, post.id),
             'comment_form': comment_form,
             'following': is_following,
-            'follower_count': follower_count,
-            'follows_count': follows_count,
+            'follower_count': user_stats.follower_count,
+            'follows_count': user_stats.follows_count,
             'does_own_profile': request.user == author,
         })
 
 
+def _comment_chunk(username, post_id, after=None):
+    """The newest comments, or the ones older than the `after` cursor, and
+    the URL of the chunk after them if there is one."""
+    comments = Comment.objects.filter(post_id=post_id).order_by(
+        *COMMENT_ORDERING)
+    values = after and decode_cursor(after, COMMENT_ORDERING, comments)
+    if values:
+        comments = comments.filter(keyset_filter(COMMENT_ORDERING, values))
+    comments = comments.select_related('author')
+    # One row past the chunk tells whether older comments exist
+    rows = list(comments[:COMMENTS_PER_PAGE + 1])
+    # Stays a queryset for the template, filled with the rows fetched
+    chunk = comments[:COMMENTS_PER_PAGE]
+    chunk._result_cache = rows[:COMMENTS_PER_PAGE]
+    older_url = None
+    if len(rows) > COMMENTS_PER_PAGE:
+        cursor = encode_cursor(rows[COMMENTS_PER_PAGE - 1], COMMENT_ORDERING)
+        older_url = (reverse('post_comments', args=[username, post_id]) +
+                     f'?after={cursor}')
+    return {'comments': chunk, 'older_comments_url': older_url}
+
+
+@condition(etag_func=author_etag)
+def post_comments(request, username, post_id):
+    get_object_or_404(Post.objects.only('id'),
+                      id=post_id,
+                      author__username=username)
+    return render(request, 'comment_list.html',
+                  _comment_chunk(username, post_id, request.GET.get('after')))
+
+
 def post_edit(request, username, post_id):
     post = get_object_or_404(Post,
                              id__exact=post_id,
@@ -122,6 +152,8 @@ def post_edit(request, username, post_id):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            if 'image' in form.changed_data:
+                thumbnails.schedule(post)
             return redirect(reverse('post', args=[username, post_id]))
 
     return render(request, 'post_edit.html', {
@@ -152,30 +184,53 @@ def add_comment(request, username, post_id):
                              author__username=username)
     if form.is_valid():
         comment = Comment(**form.cleaned_data, author=request.user, post=post)
-        comment.save()
+        with transaction.atomic():
+            comment.save()
 
     return redirect("post", username=username, post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    following = Follow.objects.filter(user=request.user).values('author')
-    posts = Post.objects.filter(author__in=following)
+    posts = timeline.feed(request.user)
 
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator, page = paginate(request, posts)
     return render(request, 'follow.html', {
         'page': page,
         'paginator': paginator
     })
 
 
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    ranked = search.ranked_post_ids(query)
+    paginator = page = None
+    truncated = False
+    if ranked is not None:
+        paginator = Paginator(ranked, PER_PAGE)
+        page = paginator.get_page(request.GET.get('page'))
+        truncated = search.is_truncated(paginator.count)
+        posts = Post.objects.for_feed().in_bulk(
+            [row['post'] for row in page.object_list])
+        page.object_list = [
+            posts[row['post']] for row in page.object_list
+            if row['post'] in posts
+        ]
+    return render(request, 'search.html', {
+        'query': query,
+        'page': page,
+        'paginator': paginator,
+        'truncated': truncated,
+        'max_results': search.MAX_CANDIDATES
+    })
+
+
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
-        Follow.objects.get_or_create(author=author, user=request.user)
+        with transaction.atomic():
+            Follow.objects.get_or_create(author=author, user=request.user)
     return redirect('profile', username=username)
 
 
@@ -184,5 +239,6 @@ def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     follow = Follow.objects.filter(author=author, user=request.user).first()
     if follow is not None:
-        follow.delete()
+        with transaction.atomic():
+            follow.delete()
     return redirect('profile', username=username)
@@ -0,0 +1,73 @@
+"""Gzip compression of responses, streamed ones included.
+
+Django's `GZipMiddleware` compresses streamed responses through zlib's
+buffer, so the start of a streamed page can stay in the buffer until
+kilobytes of the rest are rendered. `StreamingGZipMiddleware` flushes
+after every chunk instead, and only compresses the content types in
+`settings.GZIP_CONTENT_TYPES` and bodies of at least
+`settings.GZIP_MIN_LENGTH` bytes.
+"""
+import re
+from gzip import GzipFile
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import StreamingBuffer
+
+_gzip = re.compile(r'(?:^|,)\s*gzip\s*(?:;\s*q=(?P<q>[0-9.]+))?\s*(?:,|$)')
+
+
+def accepts_gzip(request):
+    """Whether Accept-Encoding allows gzip; unlike Django's check, `q=0`
+    refuses it."""
+    match = _gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if match is None:
+        return False
+    try:
+        return match.group('q') is None or float(match.group('q')) > 0
+    except ValueError:
+        return False
+
+
+def compress_chunks(chunks):
+    """Like `django.utils.text.compress_sequence`, but every chunk leaves
+    the compressor as soon as it is written."""
+    buffer = StreamingBuffer()
+    with GzipFile(mode='wb', compresslevel=6, fileobj=buffer,
+                  mtime=0) as zfile:
+        yield buffer.read()
+        for chunk in chunks:
+            if chunk:
+                zfile.write(chunk)
+                zfile.flush()
+                yield buffer.read()
+    yield buffer.read()
+
+
+def _content_type(response):
+    return response.get('Content-Type', '').partition(';')[0].strip().lower()
+
+
+class StreamingGZipMiddleware(GZipMiddleware):
+    def process_response(self, request, response):
+        if (_content_type(response) not in settings.GZIP_CONTENT_TYPES
+                or response.has_header('Content-Encoding')):
+            return response
+        if (not response.streaming
+                and len(response.content) < settings.GZIP_MIN_LENGTH):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        if not accepts_gzip(request):
+            return response
+        if not response.streaming:
+            return super().process_response(request, response)
+
+        response.streaming_content = compress_chunks(
+            response.streaming_content)
+        del response['Content-Length']
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = 'gzip'
+        return response
@@ -0,0 +1,243 @@
+"""Per-route histograms of latency, query count and response size, and
+counters of the thumbnail resolver.
+
+Each worker process counts into fixed buckets in memory and every
+`METRICS_FLUSH_INTERVAL` seconds replaces its own `<pid>-<start>.json` file
+in `METRICS_DIR`; the start time keeps a reused pid from taking over an old
+file. The `/-/metrics/` endpoint sums the files of all workers and renders
+them in the Prometheus text exposition format. Files of exited workers and
+those not written for `METRICS_MAX_AGE` seconds are removed, which
+Prometheus sees as a counter reset.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+
+PREFIX = 'yatube_'
+HISTOGRAMS = {
+    'request_duration_seconds': (
+        'Time to produce a response.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'request_queries': (
+        'SQL queries run for a request.',
+        (1, 2, 3, 5, 8, 13, 21, 50, 100),
+    ),
+    'response_size_bytes': (
+        'Size of the response body.',
+        (1024, 4096, 16384, 65536, 262144, 1048576),
+    ),
+}
+COUNTERS = {
+    'thumbnail_hits_total': 'Post images whose thumbnail was generated.',
+    'thumbnail_misses_total': 'Post images shown with a placeholder.',
+}
+
+
+def _empty(bounds):
+    # Count per bucket (the last is +Inf), then sum and count
+    return {'buckets': [0] * (len(bounds) + 1), 'sum': 0, 'count': 0}
+
+
+def _merge(into, data):
+    for name, routes in data.items():
+        for route, histogram in routes.items():
+            merged = into.setdefault(name, {}).setdefault(
+                route, _empty(HISTOGRAMS[name][1]))
+            merged['buckets'] = [
+                a + b for a, b in zip(merged['buckets'], histogram['buckets'])
+            ]
+            merged['sum'] += histogram['sum']
+            merged['count'] += histogram['count']
+
+
+def _add(into, counters):
+    for name, value in counters.items():
+        into[name] = into.get(name, 0) + value
+
+
+class Collector:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._counters = {}
+        self._pid = os.getpid()
+        self._started = time.time_ns()
+        self._flushed = 0
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Forked worker: the parent's numbers are not ours
+            self._data, self._counters = {}, {}
+            self._pid, self._flushed = os.getpid(), 0
+            self._started = time.time_ns()
+
+    def _due(self):
+        return (time.monotonic() - self._flushed >=
+                settings.METRICS_FLUSH_INTERVAL)
+
+    def observe(self, route, duration, queries, size=None):
+        values = {
+            'request_duration_seconds': duration,
+            'request_queries': queries,
+            'response_size_bytes': size,
+        }
+        with self._lock:
+            self._check_fork()
+            for name, value in values.items():
+                if value is None:
+                    continue
+                bounds = HISTOGRAMS[name][1]
+                histogram = self._data.setdefault(name, {}).setdefault(
+                    route, _empty(bounds))
+                histogram['buckets'][bisect_left(bounds, value)] += 1
+                histogram['sum'] += value
+                histogram['count'] += 1
+            due = self._due()
+        if due:
+            self.flush()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._check_fork()
+            _add(self._counters, {name: amount})
+            due = self._due()
+        if due:
+            self.flush()
+
+    def counters(self):
+        """Counters of this process alone."""
+        with self._lock:
+            self._check_fork()
+            return dict(self._counters)
+
+    def _path(self):
+        return os.path.join(settings.METRICS_DIR,
+                            f'{self._pid}-{self._started}.json')
+
+    def flush(self):
+        with self._lock:
+            data = json.dumps({
+                'histograms': self._data,
+                'counters': self._counters
+            })
+            self._flushed = time.monotonic()
+            path = self._path()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file_:
+            file_.write(data)
+        # Readers see either the old or the new file, never a torn one
+        os.replace(temporary, path)
+
+    def snapshot(self):
+        """Histograms and counters summed over every worker, this one up to
+        date."""
+        own = self._path()
+        merged = {}
+        counters = {}
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            if path == own:
+                continue
+            try:
+                if _expired(path):
+                    os.remove(path)
+                    continue
+                with open(path) as file_:
+                    data = json.load(file_)
+                _merge(merged, data['histograms'])
+                _add(counters, data['counters'])
+            except (OSError, ValueError, KeyError):
+                continue
+        with self._lock:
+            _merge(merged, self._data)
+            _add(counters, self._counters)
+        return {'histograms': merged, 'counters': counters}
+
+
+def _alive(pid):
+    if os.name != 'posix':
+        # No cheap check; such files only expire by age
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _expired(path):
+    name = os.path.basename(path)
+    try:
+        pid = int(name.split('-', 1)[0])
+    except ValueError:
+        return True
+    age = time.time() - os.path.getmtime(path)
+    return age > settings.METRICS_MAX_AGE or not _alive(pid)
+
+
+_collector = Collector()
+
+
+def observe(route, duration, queries, size=None):
+    _collector.observe(route, duration, queries, size)
+
+
+def increment(name, amount=1):
+    _collector.increment(name, amount)
+
+
+def counters():
+    return _collector.counters()
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(snapshot):
+    lines = []
+    for name, (description, bounds) in HISTOGRAMS.items():
+        metric = PREFIX + name
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} histogram')
+        histograms = snapshot['histograms'].get(name, {})
+        for route, histogram in sorted(histograms.items()):
+            route = _label(route)
+            cumulative = 0
+            for bound, count in zip([*bounds, '+Inf'],
+                                    histogram['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{route="{route}",'
+                             f'le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{route="{route}"}} '
+                         f'{_number(histogram["sum"])}')
+            lines.append(f'{metric}_count{{route="{route}"}} '
+                         f'{histogram["count"]}')
+    for name, description in COUNTERS.items():
+        metric = PREFIX + name
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {snapshot["counters"].get(name, 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    if not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(exposition(_collector.snapshot()),
+                        content_type='text/plain; version=0.0.4; '
+                        'charset=utf-8')
@@ -0,0 +1,207 @@
+"""Per-request performance instrumentation.
+
+`ServerTimingMiddleware` measures every request: SQL queries through
+`connection.execute_wrapper`, template rendering, cache lookups and the
+total time. The numbers go out as a `Server-Timing` header, which browsers
+show in the network panel, to staff users or to everyone with
+`settings.SERVER_TIMING_HEADER`. Requests slower than
+`settings.SLOW_REQUEST_THRESHOLD` milliseconds are logged to
+`yatube.performance`. Every request is also counted in the per-route
+histograms of `yatube.metrics`.
+
+Template timings come from the `TimedDjangoTemplates` backend and cache
+timings from backends built on `TimedCacheMixin`, such as `TimedLocMemCache`
+and `TimedSQLiteCache`; other backends are not measured. Outside a measured
+request they cost a single context variable lookup.
+"""
+import contextvars
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import (DjangoTemplates, Template,
+                                             reraise)
+
+from . import metrics
+from .sqlite_cache import SQLiteCache
+
+logger = logging.getLogger('yatube.performance')
+
+_current = contextvars.ContextVar('request_timings', default=None)
+_MISSING = object()
+
+
+class RequestTimings:
+    """Counters of one request; durations are in seconds."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache = 0.0
+        # Nested renders and get_many calling get are measured only once
+        self.rendering = False
+        self.in_cache = False
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+    def as_dict(self, total):
+        return {
+            'total_ms': round(total * 1000, 1),
+            'db_queries': self.queries,
+            'db_ms': round(self.db * 1000, 1),
+            'template_ms': round(self.template * 1000, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_ms': round(self.cache * 1000, 1),
+        }
+
+    def header(self, total):
+        return ', '.join([
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template * 1000:.1f}',
+            f'cache;dur={self.cache * 1000:.1f};desc="hits={self.cache_hits} '
+            f'misses={self.cache_misses}"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None or timings.rendering:
+            return super().render(context, request)
+        timings.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template += time.perf_counter() - started
+            timings.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with rendering time measured."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name),
+                                 self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def _measure_cache(timings, lookup):
+    """Runs `lookup()`, which returns `(result, hits, misses)`."""
+    timings.in_cache = True
+    started = time.perf_counter()
+    try:
+        result, hits, misses = lookup()
+    finally:
+        timings.cache += time.perf_counter() - started
+        timings.in_cache = False
+    timings.cache_hits += hits
+    timings.cache_misses += misses
+    return result
+
+
+class TimedCacheMixin:
+    """Measures `get` and `get_many` of the cache backend it is mixed
+    into."""
+
+    def get(self, key, default=None, version=None):
+        timings = _current.get()
+        if timings is None or timings.in_cache:
+            return super().get(key, default, version)
+
+        def lookup():
+            value = super(TimedCacheMixin, self).get(key, _MISSING, version)
+            if value is _MISSING:
+                return default, 0, 1
+            return value, 1, 0
+
+        return _measure_cache(timings, lookup)
+
+    def get_many(self, keys, version=None):
+        timings = _current.get()
+        if timings is None or timings.in_cache:
+            return super().get_many(keys, version)
+        keys = list(keys)
+
+        def lookup():
+            found = super(TimedCacheMixin, self).get_many(keys, version)
+            return found, len(found), len(keys) - len(found)
+
+        return _measure_cache(timings, lookup)
+
+
+class TimedLocMemCache(TimedCacheMixin, LocMemCache):
+    pass
+
+
+class TimedSQLiteCache(TimedCacheMixin, SQLiteCache):
+    pass
+
+
+class ServerTimingMiddleware:
+    """Goes first in MIDDLEWARE, so the other middleware are measured too.
+
+    The time of streamed response bodies is not included: they are
+    produced after the middleware returns.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timings.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        match = request.resolver_match
+        # Namespaced, so `admin:index` and `api:post` are routes of their own
+        metrics.observe(match.view_name if match else 'unmatched', total,
+                        timings.queries,
+                        None if response.streaming else len(response.content))
+        # Set by AuthenticationMiddleware further down, if it ran
+        user = getattr(request, 'user', None)
+        if settings.SERVER_TIMING_HEADER or (user is not None
+                                             and user.is_staff):
+            response['Server-Timing'] = timings.header(total)
+        threshold = settings.SLOW_REQUEST_THRESHOLD
+        if threshold is not None and total * 1000 >= threshold:
+            fields = {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                **timings.as_dict(total),
+            }
+            logger.warning(
+                'slow request %s',
+                ' '.join(f'{name}={value}' for name, value in fields.items()),
+                extra={'timings': fields})
+        return response
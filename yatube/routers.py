@@ -0,0 +1,125 @@
+"""Reads from replicas, writes to the primary.
+
+Inside a request `PrimaryReplicaRouter` sends reads to a random alias of
+`settings.DATABASE_REPLICAS` and every write to `default`. Replicas lag
+behind the primary, so once a request writes, its remaining reads go to
+the primary, and `ReplicaPinningMiddleware` sets a cookie that keeps the
+browser's requests on the primary for `settings.PRIMARY_PIN_SECONDS`:
+whoever wrote sees their own writes. Unsafe methods read from the
+primary from the start.
+
+Listing fragments and ETags are keyed by the listing generation in the
+cache, which is ahead of a lagging replica right after a change. A page
+rendered from the replica then would be cached and validated as new.
+So for `PRIMARY_PIN_SECONDS` after any change (`posts.caching`) requests
+that read from replicas check `may_cache()` and neither store listings
+nor send validators. A streamed response keeps its routing while its
+body is rendered.
+
+Outside requests (management commands, signal handlers run from them,
+the thumbnail threads) everything uses the primary.
+"""
+import contextvars
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from posts.caching import get_changed_at
+
+PIN_COOKIE = 'use_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_current = contextvars.ContextVar('database_pinning', default=None)
+
+
+class Pinning:
+    """Database routing state of one request."""
+
+    def __init__(self, pinned=False, lagging=False):
+        self.pinned = pinned
+        self.wrote = False
+        # Reads from replicas that may miss the last change
+        self.lagging = lagging
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        pinning = _current.get()
+        if (pinning is None or pinning.pinned
+                or not settings.DATABASE_REPLICAS
+                # Reads inside a transaction must see its writes
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        pinning = _current.get()
+        if pinning is not None:
+            pinning.pinned = pinning.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= aliases:
+            return True
+        return None
+
+
+def _changed_recently():
+    return time.time() - get_changed_at() < settings.PRIMARY_PIN_SECONDS
+
+
+def may_cache():
+    """Whether what the current request read may be cached or validated
+    under the current listing generation."""
+    pinning = _current.get()
+    return pinning is None or not pinning.lagging
+
+
+def _pinned_content(content, pinning):
+    """Iterates `content` with the routing of its request, for streamed
+    blocks that run queries after the view returned."""
+    content = iter(content)
+    while True:
+        token = _current.set(pinning)
+        try:
+            chunk = next(content)
+        except StopIteration:
+            return
+        finally:
+            _current.reset(token)
+        yield chunk
+
+
+class ReplicaPinningMiddleware:
+    """Goes before the session middleware, so session reads are routed and
+    session writes pin the browser."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = (request.method not in SAFE_METHODS
+                  or PIN_COOKIE in request.COOKIES)
+        pinning = Pinning(pinned=pinned,
+                          lagging=not pinned
+                          and bool(settings.DATABASE_REPLICAS)
+                          and _changed_recently())
+        token = _current.set(pinning)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        if response.streaming:
+            response.streaming_content = _pinned_content(
+                response.streaming_content, pinning)
+        if pinning.wrote:
+            response.set_cookie(PIN_COOKIE,
+                                '1',
+                                max_age=settings.PRIMARY_PIN_SECONDS,
+                                httponly=True,
+                                samesite='Lax')
+        return response
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import hashlib
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -48,6 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.middleware.ServerTimingMiddleware',
+    'yatube.compression.StreamingGZipMiddleware',
+    'yatube.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,12 +67,15 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with rendering time measured for Server-Timing
+        'BACKEND': 'yatube.middleware.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'users.context_processors.year',
+                'posts.context_processors.listing_cache',
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -89,6 +97,17 @@ DATABASES = {
     }
 }
 
+# Aliases of DATABASES that requests read from; writes go to 'default', see
+# yatube/routers.py. To try it locally copy db.sqlite3 to replica.sqlite3,
+# add it as DATABASES['replica'] and list 'replica' here
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['yatube.routers.PrimaryReplicaRouter']
+
+# After writing, a browser reads from the primary for this many seconds,
+# and after a change to what listings show pages read from replicas are
+# not cached for as long. Should exceed the replication lag
+PRIMARY_PIN_SECONDS = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -129,6 +148,10 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
+# collectstatic writes content-hashed names and gzipped copies, which
+# yatube.staticfiles.serve sends with far-future cache headers
+STATICFILES_STORAGE = (
+    'yatube.staticfiles.CompressedManifestStaticFilesStorage')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -141,8 +164,73 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 3
 
+# LocMemCache is private to a process. When serving with several worker
+# processes switch to the shared backend, see yatube/sqlite_cache.py. The
+# Timed* variants from yatube/middleware.py report to Server-Timing
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'yatube.middleware.TimedLocMemCache',
     }
 }
+
+# Number of posts kept in each user's materialized follow feed
+TIMELINE_LENGTH = 500
+
+# Cached ids of the authors each user follows, see posts/followgraph.py.
+# With FEED_FROM_FOLLOW_GRAPH the follow feed filters posts by them
+# instead of reading the materialized feed
+FOLLOW_GRAPH_TIMEOUT = 60 * 60 * 24
+FEED_FROM_FOLLOW_GRAPH = False
+
+# Listing fragments are invalidated by posts.caching generation bumps,
+# so they can live long
+LISTING_CACHE_TIMEOUT = 60 * 60
+
+# Rendered post cards are keyed by post version and never go stale
+POST_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+# Threads generating thumbnails after upload; 0 generates them in-line
+THUMBNAIL_WORKERS = 2
+# Seconds before an image whose thumbnails failed is queued again
+THUMBNAIL_RETRY_DELAY = 60 * 10
+
+# Uploads are streamed to temporary files, never held in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 0
+
+# Uploaded post images are re-encoded to fit a square of this many pixels;
+# images with more pixels than the limit are rejected before decoding
+IMAGE_UPLOAD_MAX_SIZE = 2048
+IMAGE_UPLOAD_MAX_PIXELS = 50 * 10**6
+IMAGE_UPLOAD_FORMAT = 'JPEG'
+IMAGE_UPLOAD_QUALITY = 85
+
+# yatube.compression gzips responses of these types, streamed ones and
+# others of at least GZIP_MIN_LENGTH bytes
+GZIP_MIN_LENGTH = 1024
+GZIP_CONTENT_TYPES = (
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+)
+
+# Server-Timing headers with SQL, template and cache timings of a request,
+# for everyone rather than only staff users
+SERVER_TIMING_HEADER = DEBUG
+
+# Requests slower than this many milliseconds are logged to
+# yatube.performance; None turns the log off
+SLOW_REQUEST_THRESHOLD = 500
+
+# Worker processes share per-route request histograms through files in
+# this directory, flushed every METRICS_FLUSH_INTERVAL seconds. Each
+# deployment needs its own; the default is named after BASE_DIR. Files not
+# written for METRICS_MAX_AGE seconds are removed
+METRICS_DIR = os.path.join(
+    tempfile.gettempdir(),
+    'yatube-metrics-' + hashlib.md5(BASE_DIR.encode()).hexdigest()[:8])
+METRICS_FLUSH_INTERVAL = 10
+METRICS_MAX_AGE = 60 * 60 * 24
@@ -0,0 +1,264 @@
+"""SQLite-backed cache shared by every worker process on a host.
+
+LocMemCache gives each worker its own cold copy, so an invalidation done by
+one worker is invisible to the others. This backend keeps entries in a
+single SQLite file in WAL mode instead. Reads from different processes do
+not block each other, and writers serialize on SQLite's lock, which also
+makes `incr` atomic across processes.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.sqlite_cache.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 100000, 'MAX_SIZE': 256 * 2 ** 20},
+        }
+    }
+
+Eviction is least-recently-used and bounded by MAX_ENTRIES and the optional
+MAX_SIZE (bytes of stored values). The bounds are checked every
+CULL_CHECK_INTERVAL writes of a process rather than on every write, so the
+table may briefly overshoot them.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# SQLite's default limit of host parameters in one statement is 999
+CHUNK_SIZE = 500
+# Reads refresh the LRU timestamp only when it is older than this, so hot
+# keys do not turn every get into a write
+ACCESS_RESOLUTION = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+"""
+
+
+def _chunks(items):
+    items = list(items)
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        options = params.get('OPTIONS', {})
+        self._max_size = options.get('MAX_SIZE')
+        self._cull_check_interval = options.get('CULL_CHECK_INTERVAL', 32)
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def _connection(self):
+        # Connections must not cross threads or survive a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self._path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self._path,
+                                         timeout=30,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+    def _encode(self, value):
+        # Integers are stored natively so `incr` can run as one UPDATE
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _decode(self, value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def _fetch(self, keys):
+        """Live `{key: value}` rows for `keys`, refreshing their LRU stamp."""
+        now = time.time()
+        found = {}
+        stale = []
+        for chunk in _chunks(keys):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._connection.execute(
+                'SELECT key, value, expires, accessed FROM cache '
+                f'WHERE key IN ({placeholders})', chunk)
+            for key, value, expires, accessed in rows:
+                if expires is not None and expires <= now:
+                    continue
+                found[key] = value
+                if accessed < now - ACCESS_RESOLUTION:
+                    stale.append(key)
+        if stale:
+            with self._transaction() as connection:
+                connection.executemany(
+                    'UPDATE cache SET accessed = ? WHERE key = ?',
+                    [(now, key) for key in stale])
+        return found
+
+    def _store(self, items, timeout, mode='REPLACE'):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        rows = [(key, self._encode(value), expires, now)
+                for key, value in items]
+        with self._transaction() as connection:
+            if mode == 'IGNORE':
+                # Expired rows must not block `add`
+                connection.executemany(
+                    'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                    [(row[0], now) for row in rows])
+            cursor = connection.executemany(
+                f'INSERT OR {mode} INTO cache '
+                '(key, value, expires, accessed) VALUES (?, ?, ?, ?)', rows)
+            stored = cursor.rowcount
+        self._writes += 1
+        if self._writes % self._cull_check_interval == 0:
+            self._cull()
+        return stored
+
+    def _cull(self):
+        with self._transaction() as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE expires IS NOT NULL '
+                'AND expires <= ?', (time.time(), ))
+            count, size = connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) '
+                'FROM cache').fetchone()
+            excess = count - self._max_entries
+            if excess > 0:
+                # Like the built-in backends, cull 1/CULL_FREQUENCY at once
+                excess = max(excess, count // self._cull_frequency)
+                connection.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                    'ORDER BY accessed LIMIT ?)', (excess, ))
+            while self._max_size and size > self._max_size:
+                connection.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                    'ORDER BY accessed LIMIT ?)',
+                    (max(1, count // self._cull_frequency), ))
+                count, size = connection.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) '
+                    'FROM cache').fetchone()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._store([(key, value)], timeout, mode='IGNORE') == 1
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        found = self._fetch([key])
+        if key not in found:
+            return default
+        return self._decode(found[key])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._store([(key, value)], timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE cache SET expires = ?, accessed = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), now, key, now))
+            return cursor.rowcount == 1
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_key(key, version=version): key for key in keys}
+        for key in key_map:
+            self.validate_key(key)
+        found = self._fetch(key_map)
+        return {
+            key_map[key]: self._decode(value)
+            for key, value in found.items()
+        }
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        items = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            items.append((key, value))
+        if items:
+            self._store(items, timeout)
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        for key in keys:
+            self.validate_key(key)
+        with self._transaction() as connection:
+            for chunk in _chunks(keys):
+                placeholders = ','.join('?' * len(chunk))
+                connection.execute(
+                    f'DELETE FROM cache WHERE key IN ({placeholders})', chunk)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key in self._fetch([key])
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE cache SET value = value + ?, accessed = ? '
+                "WHERE key = ? AND typeof(value) = 'integer' "
+                'AND (expires IS NULL OR expires > ?)',
+                (delta, now, key, now))
+            if cursor.rowcount != 1:
+                raise ValueError("Key '%s' not found" % key)
+            return connection.execute('SELECT value FROM cache WHERE key = ?',
+                                      (key, )).fetchone()[0]
+
+    def clear(self):
+        self._connection.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Connections are reused for the lifetime of the thread
+        pass
+
+
+class _Transaction:
+    """`BEGIN IMMEDIATE` block: takes the write lock up front, so
+    read-modify-write sequences are atomic across processes."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
@@ -0,0 +1,121 @@
+"""Content-hashed, precompressed static files.
+
+`collectstatic` with `CompressedManifestStaticFilesStorage` writes every
+file under a name containing a hash of its content, records the names in
+`staticfiles.json` and stores a gzipped copy next to each text asset. A
+changed file gets a new name, so `serve` can let browsers cache hashed
+names forever, and it sends the `.gz` copy to clients that accept gzip
+without compressing anything per request.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import shutil
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+                                                staticfiles_storage)
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+from .compression import accepts_gzip
+
+COMPRESSIBLE = {
+    '.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico',
+    '.eot', '.otf', '.ttf'
+}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Unhashed names can change content under the same URL
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+
+def _compress(path):
+    temporary = path + '.gz.tmp'
+    # A fixed mtime keeps the output identical for identical input
+    with open(path, 'rb') as source, gzip.GzipFile(
+            temporary, 'wb', compresslevel=9, mtime=0) as target:
+        shutil.copyfileobj(source, target)
+    if os.path.getsize(temporary) < os.path.getsize(path):
+        os.replace(temporary, path + '.gz')
+    else:
+        os.remove(temporary)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        # CSS files are yielded once per pass, the last hashed name is final
+        final = {}
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                final[name] = hashed_name
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name, hashed_name in sorted(final.items()):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+                _compress(self.path(name))
+                if hashed_name:
+                    _compress(self.path(hashed_name))
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            # Nothing collected yet: plain names work, just without long
+            # caching. Once there is a manifest a missing name raises
+            return name
+        return super().stored_name(name)
+
+
+# The storage's hashed_files and the set of their names, rebuilt when
+# collectstatic replaces the dict
+_hashed_names = ({}, frozenset())
+
+
+def _is_hashed(name):
+    global _hashed_names
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+    source, names = _hashed_names
+    if source is not hashed_files:
+        names = frozenset(hashed_files.values())
+        _hashed_names = (hashed_files, names)
+    return name in names
+
+
+@require_safe
+def serve(request, path):
+    """Serves a collected static file, gzipped when the client accepts it
+    and a `.gz` copy exists."""
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    compressed = full_path + '.gz'
+    has_gzip = os.path.isfile(compressed)
+    encoding = None
+    if has_gzip and accepts_gzip(request):
+        full_path, encoding = compressed, 'gzip'
+
+    stat = os.stat(full_path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(full_path, 'rb'))
+        response['Content-Type'] = (mimetypes.guess_type(name)[0]
+                                    or 'application/octet-stream')
+        response['Content-Length'] = stat.st_size
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = IMMUTABLE if _is_hashed(name) else REVALIDATE
+    if has_gzip:
+        response['Vary'] = 'Accept-Encoding'
+    return response
@@ -14,12 +14,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.contrib.flatpages import views
 from django.conf.urls import handler404, handler500
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .metrics import metrics_view
+from .staticfiles import serve as serve_static
+
 handler404 = "posts.views.page_not_found"
 handler500 = "posts.views.server_error"
 
@@ -28,6 +31,13 @@ urlpatterns = [
     path('about/', include('django.contrib.flatpages.urls')),
     path('auth/', include('users.urls')),
     path("auth/", include("django.contrib.auth.urls")),
+    # Under "-/": at the top level it would hide the profile of a user
+    # named "metrics"
+    path("-/metrics/", metrics_view, name="metrics"),
+    re_path(r'^{}(?P<path>.+)$'.format(settings.STATIC_URL.lstrip('/')),
+            serve_static,
+            name="static"),
+    path("api/v1/", include("posts.api_urls")),
     path("", include("posts.urls")),
 ]
 
@@ -45,5 +55,3 @@ urlpatterns += [
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL,
                           document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL,
-                          document_root=settings.STATIC_ROOT)